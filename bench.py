@@ -0,0 +1,652 @@
+# Нагрузочные сценарии для API бронирования
+# Запуск: python bench.py <сценарий> [параметры], список сценариев: python bench.py --help
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def import_app():
+    # main.py создаёт booking.db в текущей папке, поэтому каждый прогон идёт в своей временной папке
+    os.chdir(tempfile.mkdtemp(prefix="booking-bench-"))
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+def admin_client(main, raise_server_exceptions=True):
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app, raise_server_exceptions=raise_server_exceptions)
+    client.post("/register", json={"email": "admin@bench", "name": "Bench", "password": "bench", "role": "admin"})
+    token = client.post("/token", data={"username": "admin@bench", "password": "bench"}).json()["access_token"]
+    client.headers["Authorization"] = f"Bearer {token}"
+    return client
+
+def create_flight(client, departure_city, arrival_city, departure_time, arrival_time, seats):
+    return client.post("/flights", json={
+        "departure_city": departure_city,
+        "arrival_city": arrival_city,
+        "departure_time": departure_time,
+        "arrival_time": arrival_time,
+        "price": 100.0,
+        "total_seats": seats,
+    }).json()["id"]
+
+# Параллельные бронирования мест: ни одной перепроданной брони и пропускная способность
+def flight_booking_stress(args):
+    main = import_app()
+    client = admin_client(main)
+    first = create_flight(client, "Moscow", "Berlin", "2025-10-25T08:00:00", "2025-10-25T10:00:00", args.seats)
+    second = create_flight(client, "Berlin", "London", "2025-10-25T12:00:00", "2025-10-25T13:00:00", args.seats)
+
+    def book(_):
+        if args.itinerary:
+            response = client.post("/flights/book", json={"flight_ids": [first, second], "passengers": 1})
+        else:
+            response = client.post(f"/flights/book/{first}", params={"passengers": 1})
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        statuses = Counter(pool.map(book, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    db = main.SessionLocal()
+    booked = [db.get(main.Flight, flight_id).booked_seats for flight_id in (first, second)]
+    db.close()
+    legs = booked if args.itinerary else booked[:1]
+    oversold = max(0, max(legs) - args.seats)
+    consistent = all(seats == statuses[200] for seats in legs)
+    report = {
+        "scenario": "flight_booking_stress",
+        "itinerary": args.itinerary,
+        "threads": args.threads,
+        "requests": args.requests,
+        "seats": args.seats,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "booked_seats": legs,
+        "oversold": oversold,
+        "consistent": consistent,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(args.requests / elapsed, 1),
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if oversold == 0 and consistent else 1
+
+# Запуск режима сценария в отдельном процессе: настройки main.py читаются при импорте
+def run_worker(scenario, options, env):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), scenario, "--worker", *options],
+        env={**os.environ, **env},
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+# Один режим сценария async_db: нагрузка идёт через ASGI в том же процессе, что и приложение
+async def async_db_worker(args):
+    import httpx
+    main = import_app()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/register", json={"email": "admin@bench", "name": "Bench", "password": "bench", "role": "admin"})
+        token = (await client.post("/token", data={"username": "admin@bench", "password": "bench"})).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        hotel = (await client.post("/hotels", json={"name": "Bench", "city": "Paris", "stars": 4})).json()["id"]
+        room = (await client.post("/rooms", json={
+            "hotel_id": hotel, "type": "Double", "rooms_count": args.requests, "price": 100.0, "capacity": 2
+        })).json()["id"]
+        for departure_city, arrival_city, hour in (("Moscow", "Berlin", 8), ("Berlin", "London", 12), ("Moscow", "London", 9)):
+            await client.post("/flights", json={
+                "departure_city": departure_city,
+                "arrival_city": arrival_city,
+                "departure_time": f"2025-10-25T{hour:02d}:00:00",
+                "arrival_time": f"2025-10-25T{hour + 2:02d}:00:00",
+                "price": 100.0,
+                "total_seats": args.requests,
+            })
+
+        requests = [
+            lambda: client.get("/available_rooms", params={"check_in": "2025-10-25T10:00:00", "check_out": "2025-10-26T10:00:00"}),
+            lambda: client.post("/bookings/by_dates", json={"room_id": room, "check_in": "2025-10-25T10:00:00", "check_out": "2025-10-26T10:00:00"}),
+            lambda: client.post("/flights/search", json={
+                "from_city": "Moscow", "to_city": "London",
+                "date_from": "2025-10-25T00:00:00", "date_to": "2025-10-25T23:59:59", "passengers": 1
+            }),
+            lambda: client.post("/flights/book/1", params={"passengers": 1}),
+        ]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        statuses = Counter()
+
+        async def call(number):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await requests[number % len(requests)]()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(call(number) for number in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": "async" if main.ASYNC_DB_ENABLED else "sync",
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(args.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+# Синхронный и асинхронный доступ к БД под одной смешанной нагрузкой, каждый режим в своём процессе
+def async_db(args):
+    if args.worker:
+        print(json.dumps(asyncio.run(async_db_worker(args))))
+        return 0
+    options = ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    modes = [run_worker("async_db", options, {"ASYNC_DB_ENABLED": flag}) for flag in ("0", "1")]
+    report = {
+        "scenario": "async_db",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "modes": modes,
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if all(set(mode["statuses"]) == {"200"} for mode in modes) else 1
+
+# Всплеск логинов и задержка поиска рядом с ним: хеширование в потоке запроса против пула процессов
+def login_storm_worker(args):
+    main = import_app()
+    client = admin_client(main)
+    for number in range(args.users):
+        client.post("/register", json={"email": f"user{number}@bench", "name": "User", "password": "bench", "role": "user"})
+    create_flight(client, "Moscow", "London", "2025-10-25T08:00:00", "2025-10-25T10:00:00", 100)
+    search = {"from_city": "Moscow", "to_city": "London",
+              "date_from": "2025-10-25T00:00:00", "date_to": "2025-10-25T23:59:59", "passengers": 1}
+    finished = threading.Event()
+    search_latencies = []
+
+    def probe():
+        while not finished.is_set():
+            started = time.perf_counter()
+            client.post("/flights/search", json=search)
+            search_latencies.append(time.perf_counter() - started)
+
+    def login(number):
+        response = client.post("/token", data={"username": f"user{number % args.users}@bench", "password": "bench"})
+        return response.status_code
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        statuses = Counter(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - started
+    finished.set()
+    prober.join()
+
+    return {
+        "hash_workers": main.HASH_WORKERS,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "logins_per_second": round(statuses[200] / elapsed, 1),
+        "search_p50_ms": round(percentile(search_latencies, 0.5) * 1000, 2),
+        "search_p95_ms": round(percentile(search_latencies, 0.95) * 1000, 2),
+        "hashing": client.get("/metrics").json()["password_hashing"],
+    }
+
+def login_storm(args):
+    if args.worker:
+        print(json.dumps(login_storm_worker(args)))
+        return 0
+    options = ["--threads", str(args.threads), "--logins", str(args.logins), "--users", str(args.users)]
+    modes = [run_worker("login_storm", options, {"HASH_WORKERS": workers}) for workers in ("0", str(args.hash_workers))]
+    report = {
+        "scenario": "login_storm",
+        "threads": args.threads,
+        "logins": args.logins,
+        "modes": modes,
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if all(set(mode["statuses"]) <= {"200", "503"} for mode in modes) else 1
+
+# Поток записей: брони комнат и мест на рейсы из многих потоков при выбранном профиле хранилища
+def sqlite_writes_worker(args):
+    main = import_app()
+    client = admin_client(main, raise_server_exceptions=False)
+    hotel = client.post("/hotels", json={"name": "Bench", "city": "Paris", "stars": 4}).json()["id"]
+    room = client.post("/rooms", json={
+        "hotel_id": hotel, "type": "Double", "rooms_count": args.rooms, "price": 100.0, "capacity": 2
+    }).json()["id"]
+    flight = create_flight(client, "Moscow", "London", "2025-10-25T08:00:00", "2025-10-25T10:00:00", args.requests)
+
+    def write(number):
+        if number % 2:
+            response = client.post(f"/flights/book/{flight}", params={"passengers": 1})
+        else:
+            response = client.post("/bookings/by_dates", json={
+                "room_id": room, "check_in": "2025-10-25T10:00:00", "check_out": "2025-10-26T10:00:00"
+            })
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        statuses = Counter(pool.map(write, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    db = main.SessionLocal()
+    room_bookings = db.query(main.Booking).filter(main.Booking.room_id == room).count()
+    db.close()
+    return {
+        "profile": main.STORAGE_PROFILE,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "room_bookings": room_bookings,
+        "overbooked": max(0, room_bookings - args.rooms),
+        "seconds": round(elapsed, 3),
+        "writes_per_second": round(args.requests / elapsed, 1),
+    }
+
+def sqlite_writes(args):
+    if args.worker:
+        print(json.dumps(sqlite_writes_worker(args)))
+        return 0
+    options = ["--threads", str(args.threads), "--requests", str(args.requests), "--rooms", str(args.rooms)]
+    modes = [run_worker("sqlite_writes", options, {"STORAGE_PROFILE": profile}) for profile in ("plain", "tuned")]
+    report = {
+        "scenario": "sqlite_writes",
+        "threads": args.threads,
+        "requests": args.requests,
+        "rooms": args.rooms,
+        "modes": modes,
+    }
+    print(json.dumps(report, indent=2))
+    # Профиль plain оставлен для сравнения: без BEGIN IMMEDIATE проверка и вставка брони могут разойтись
+    return 0 if modes[-1]["overbooked"] == 0 else 1
+
+# Загрузка расписания: по одному POST /flights против POST /flights/bulk с телом CSV
+def bulk_ingest(args):
+    main = import_app()
+    client = admin_client(main)
+    lines = ["departure_city,arrival_city,departure_time,arrival_time,price,total_seats"]
+    for number in range(args.rows):
+        day, minute = divmod(number, 24 * 60)
+        departure = f"2025-{10 + day // 28:02d}-{1 + day % 28:02d}T{minute // 60:02d}:{minute % 60:02d}:00"
+        lines.append(f"City{number % 97},City{(number * 7 + 1) % 97},{departure},{departure[:-2]}59,{100 + number % 300},150")
+
+    started = time.perf_counter()
+    for line in lines[1:args.single + 1]:
+        departure_city, arrival_city, departure_time, arrival_time, price, seats = line.split(",")
+        client.post("/flights", json={
+            "departure_city": departure_city, "arrival_city": arrival_city,
+            "departure_time": departure_time, "arrival_time": arrival_time,
+            "price": float(price), "total_seats": int(seats),
+        })
+    single = args.single / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    first = client.post("/flights/bulk", content="\n".join(lines).encode(), headers={"Content-Type": "text/csv"}).json()
+    elapsed = time.perf_counter() - started
+    again = client.post("/flights/bulk", content="\n".join(lines).encode(), headers={"Content-Type": "text/csv"}).json()
+    report = {
+        "scenario": "bulk_ingest",
+        "rows": args.rows,
+        "single_post_rows_per_second": round(single, 1),
+        "bulk_rows_per_second": round(args.rows / elapsed, 1),
+        "bulk": {key: first[key] for key in ("inserted", "updated", "failed", "seconds")},
+        "repeat": {key: again[key] for key in ("inserted", "updated", "failed", "seconds")},
+    }
+    print(json.dumps(report, indent=2))
+    # Первые строки уже созданы поштучно, повторная загрузка должна только обновлять
+    return 0 if first["failed"] == 0 and again["inserted"] == 0 else 1
+
+# Стоимость кодирования одной строки ответа: ORM-объект и модель FlightOut против выбранных колонок и json_bytes
+def serialization(args):
+    main = import_app()
+    from pydantic import TypeAdapter
+    from sqlalchemy import insert, select
+    from typing import List
+    db = main.SessionLocal()
+    start = datetime(2025, 10, 1)
+    db.execute(insert(main.Flight), [{
+        "departure_city": f"City{number % 97}", "arrival_city": f"City{(number * 7 + 1) % 97}",
+        "departure_time": start + timedelta(minutes=number), "arrival_time": start + timedelta(minutes=number + 90),
+        "price": 100.0 + number % 300, "total_seats": 150, "booked_seats": number % 150,
+    } for number in range(args.rows)])
+    db.commit()
+    flights_json = TypeAdapter(List[main.FlightOut])
+
+    # Так ответ собирался раньше: копия __dict__ ORM-объекта в модель и повторная проверка через response_model
+    def model_path():
+        db.expunge_all()
+        flights = db.scalars(select(main.Flight).order_by(main.Flight.id)).all()
+        items = [main.FlightOut(**f.__dict__, available_seats=f.total_seats - f.booked_seats) for f in flights]
+        return flights_json.dump_json(flights_json.validate_python(items, from_attributes=True))
+
+    def columns_path():
+        rows = db.execute(select(*main.FLIGHT_OUT_COLUMNS).order_by(main.Flight.id)).all()
+        return main.json_bytes(main.row_dicts(rows))
+
+    paths = {"orm_model": model_path, "columns_json": columns_path}
+    if json.loads(model_path()) != json.loads(columns_path()):
+        print("ответы двух путей различаются", file=sys.stderr)
+        return 1
+    timings = {}
+    for name, path in paths.items():
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            path()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    db.close()
+    report = {
+        "scenario": "serialization",
+        "rows": args.rows,
+        "encoder": "orjson" if main.orjson is not None else "json",
+        "microseconds_per_row": {name: round(best / args.rows * 1e6, 2) for name, best in timings.items()},
+        "speedup": round(timings["orm_model"] / timings["columns_json"], 2),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+# Синтетические данные набора тестов: размер задаёт масштаб всех таблиц сразу
+DATASET_SIZES = {
+    "small": {"users": 200, "hotels": 50, "rooms_per_hotel": 4, "bookings": 2000, "cities": 20, "days": 14},
+    "medium": {"users": 2000, "hotels": 500, "rooms_per_hotel": 5, "bookings": 20000, "cities": 40, "days": 30},
+    "large": {"users": 20000, "hotels": 5000, "rooms_per_hotel": 6, "bookings": 200000, "cities": 80, "days": 60},
+}
+DATASET_START = datetime(2025, 10, 1)
+ROOM_TYPES = (("Single", 1, 60.0), ("Double", 2, 90.0), ("Family", 4, 150.0), ("Suite", 2, 260.0))
+
+# Сеть рейсов по схеме хабов: хабы связаны между собой, остальные города летают в два ближайших хаба
+# и немного напрямую; длительность и цена растут с расстоянием между случайными координатами городов
+def flight_network(rng, cities, days):
+    points = {city: (rng.uniform(0, 4000), rng.uniform(0, 3000)) for city in cities}
+    hubs = cities[:max(2, len(cities) // 5)]
+    routes = set()
+
+    def distance(a, b):
+        return ((points[a][0] - points[b][0]) ** 2 + (points[a][1] - points[b][1]) ** 2) ** 0.5
+
+    for a in hubs:
+        for b in hubs:
+            if a != b:
+                routes.add((a, b, 4))
+    for city in cities[len(hubs):]:
+        for hub in sorted(hubs, key=lambda hub: distance(city, hub))[:2]:
+            routes.add((city, hub, 2))
+            routes.add((hub, city, 2))
+        for other in rng.sample(cities[len(hubs):], 2):
+            if other != city:
+                routes.add((city, other, 1))
+
+    flights = []
+    for departure_city, arrival_city, per_day in sorted(routes):
+        minutes = 45 + int(distance(departure_city, arrival_city) / 12)
+        base_price = 40 + distance(departure_city, arrival_city) * 0.08
+        for day in range(days):
+            for slot in range(per_day):
+                departure = DATASET_START + timedelta(days=day, hours=6 + slot * 16 // per_day, minutes=rng.randrange(0, 60, 5))
+                seats = rng.choice((120, 150, 180))
+                flights.append({
+                    "departure_city": departure_city, "arrival_city": arrival_city,
+                    "departure_time": departure, "arrival_time": departure + timedelta(minutes=minutes),
+                    "price": round(base_price * rng.uniform(0.8, 1.4), 2),
+                    "total_seats": seats, "booked_seats": int(seats * rng.uniform(0, 0.7)),
+                })
+    return flights
+
+def generate_dataset(main, size, seed):
+    from sqlalchemy import insert
+    params = DATASET_SIZES[size]
+    rng = random.Random(seed)
+    cities = [f"City{number:03d}" for number in range(params["cities"])]
+    # Один хеш на всех: генерация не тратит время на bcrypt, а /token проверяет настоящий пароль
+    hashed = main.get_password_hash("bench")
+    db = main.SessionLocal()
+    db.execute(insert(main.User), [
+        {"email": f"user{number}@bench", "name": f"User {number}", "hashed_password": hashed, "role": "user"}
+        for number in range(params["users"])
+    ])
+    db.execute(insert(main.Hotel), [
+        {"name": f"Hotel {number}", "city": rng.choice(cities), "stars": rng.randint(1, 5)}
+        for number in range(params["hotels"])
+    ])
+    rooms = []
+    for hotel_id in range(1, params["hotels"] + 1):
+        for type, capacity, price in rng.sample(ROOM_TYPES, min(len(ROOM_TYPES), params["rooms_per_hotel"])):
+            rooms.append({"hotel_id": hotel_id, "type": type, "rooms_count": rng.randint(2, 20),
+                          "price": round(price * rng.uniform(0.7, 1.8), 2), "capacity": capacity})
+        for _ in range(params["rooms_per_hotel"] - len(ROOM_TYPES)):
+            type, capacity, price = rng.choice(ROOM_TYPES)
+            rooms.append({"hotel_id": hotel_id, "type": type, "rooms_count": rng.randint(2, 20),
+                          "price": round(price * rng.uniform(0.7, 1.8), 2), "capacity": capacity})
+    db.execute(insert(main.Room), rooms)
+
+    # Брони не превышают число комнат ни в одну ночь, как если бы они прошли через API
+    occupied = Counter()
+    bookings = []
+    for _ in range(params["bookings"]):
+        room_id = rng.randrange(1, len(rooms) + 1)
+        first_night, nights = rng.randrange(params["days"]), rng.randint(1, 5)
+        if any(occupied[room_id, night] >= rooms[room_id - 1]["rooms_count"] for night in range(first_night, first_night + nights)):
+            continue
+        for night in range(first_night, first_night + nights):
+            occupied[room_id, night] += 1
+        check_in = DATASET_START + timedelta(days=first_night, hours=14)
+        bookings.append({"user_id": rng.randrange(1, params["users"] + 1), "room_id": room_id,
+                         "check_in": check_in, "check_out": check_in + timedelta(days=nights, hours=-2)})
+    if bookings:
+        db.execute(insert(main.Booking), bookings)
+    flights = flight_network(rng, cities, params["days"])
+    db.execute(insert(main.Flight), flights)
+    db.commit()
+    db.close()
+    return {"cities": cities, "users": params["users"], "hotels": params["hotels"], "rooms": len(rooms),
+            "bookings": len(bookings), "flights": len(flights), "days": params["days"]}
+
+# Запросы сценариев набора: каждый вызов делает один запрос со случайными параметрами из данных
+def suite_scenarios(client, data, tokens, rng):
+    def dates(max_nights):
+        check_in = DATASET_START + timedelta(days=rng.randrange(data["days"]), hours=14)
+        return check_in, check_in + timedelta(days=rng.randint(1, max_nights), hours=-2)
+
+    def auth():
+        return {"Authorization": f"Bearer {rng.choice(tokens)}"}
+
+    def available_rooms():
+        check_in, check_out = dates(4)
+        params = {"check_in": check_in.isoformat(), "check_out": check_out.isoformat(), "limit": 50}
+        if rng.random() < 0.5:
+            params["hotel_id"] = rng.randint(1, data["hotels"])
+        return client.get("/available_rooms", params=params)
+
+    def flights_search():
+        from_city, to_city = rng.sample(data["cities"], 2)
+        day = DATASET_START + timedelta(days=rng.randrange(data["days"] - 1))
+        return client.post("/flights/search", json={
+            "from_city": from_city, "to_city": to_city, "passengers": rng.randint(1, 3),
+            "date_from": day.isoformat(), "date_to": (day + timedelta(days=1)).isoformat(),
+        })
+
+    def bookings_by_dates():
+        check_in, check_out = dates(3)
+        return client.post("/bookings/by_dates", headers=auth(), json={
+            "room_id": rng.randint(1, data["rooms"]), "check_in": check_in.isoformat(), "check_out": check_out.isoformat(),
+        })
+
+    def flights_book():
+        return client.post(f"/flights/book/{rng.randint(1, data['flights'])}", headers=auth(), params={"passengers": 1})
+
+    def token():
+        return client.post("/token", data={"username": f"user{rng.randrange(data['users'])}@bench", "password": "bench"})
+
+    return {
+        "available_rooms": available_rooms,
+        "flights_search": flights_search,
+        "bookings_by_dates": bookings_by_dates,
+        "flights_book": flights_book,
+        "token": token,
+    }
+
+def run_scenario(request, requests, concurrency, warmup):
+    for _ in range(warmup):
+        request()
+    latencies = []
+    statuses = Counter()
+
+    def call(_):
+        started = time.perf_counter()
+        response = request()
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for latency, code in pool.map(call, range(requests)):
+            latencies.append(latency)
+            statuses[code] += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def git_revision():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+# Изменение относительно сохранённого прогона: отношение пропускной способности и задержек к прежним
+def compare_runs(current, baseline):
+    changes = {}
+    for name, result in current.items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        changes[name] = {
+            "requests_per_second": round(result["requests_per_second"] / before["requests_per_second"], 3),
+            **{key: round(result[key] / before[key], 3) for key in ("p50_ms", "p95_ms", "p99_ms") if before[key]},
+        }
+    return changes
+
+# Набор сценариев на синтетических данных: реальные эндпоинты в процессе, результат сохраняется в JSON
+def suite(args):
+    # Кэши поиска и каталога по умолчанию выключены, иначе повторяющиеся запросы измеряют кэш, а не код
+    if not args.caches:
+        os.environ["SEARCH_CACHE_ENABLED"] = "0"
+        os.environ["CATALOG_CACHE_ENABLED"] = "0"
+    main = import_app()
+    from fastapi.testclient import TestClient
+    started = time.perf_counter()
+    data = generate_dataset(main, args.size, args.seed)
+    generated = time.perf_counter() - started
+    db = main.SessionLocal()
+    tokens = [main.create_user_token(user)["access_token"] for user in db.query(main.User).limit(50)]
+    db.close()
+    client = TestClient(main.app)
+    rng = random.Random(args.seed + 1)
+    scenarios = suite_scenarios(client, data, tokens, rng)
+    selected = args.scenarios or list(scenarios)
+    results = {}
+    for name in selected:
+        requests = max(1, args.requests // 10) if name == "token" else args.requests
+        results[name] = run_scenario(scenarios[name], requests, args.concurrency, args.warmup)
+    report = {
+        "scenario": "suite",
+        "revision": git_revision(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "size": args.size,
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "caches": args.caches,
+        "dataset": {key: value for key, value in data.items() if key != "cities"},
+        "generate_seconds": round(generated, 2),
+        "scenarios": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["against_baseline"] = compare_runs(results, json.load(baseline))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    print(json.dumps(report, indent=2))
+    server_errors = sum(count for result in results.values() for code, count in result["statuses"].items() if code.startswith("5"))
+    return 0 if server_errors == 0 else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии API бронирования")
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    stress = scenarios.add_parser("flight_booking_stress", help="параллельное бронирование мест на рейс")
+    stress.add_argument("--threads", type=int, default=32)
+    stress.add_argument("--requests", type=int, default=2000)
+    stress.add_argument("--seats", type=int, default=500)
+    stress.add_argument("--itinerary", action="store_true", help="бронировать маршрут из двух перелётов")
+    stress.set_defaults(run=flight_booking_stress)
+
+    async_parser = scenarios.add_parser("async_db", help="сравнение синхронного и асинхронного доступа к БД")
+    async_parser.add_argument("--requests", type=int, default=2000)
+    async_parser.add_argument("--concurrency", type=int, default=64)
+    async_parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    async_parser.set_defaults(run=async_db)
+
+    storm = scenarios.add_parser("login_storm", help="всплеск логинов и задержка поиска рядом с ним")
+    storm.add_argument("--threads", type=int, default=32)
+    storm.add_argument("--logins", type=int, default=200)
+    storm.add_argument("--users", type=int, default=20)
+    storm.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1)
+    storm.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    storm.set_defaults(run=login_storm)
+
+    writes = scenarios.add_parser("sqlite_writes", help="параллельные записи при профилях хранилища plain и tuned")
+    writes.add_argument("--threads", type=int, default=32)
+    writes.add_argument("--requests", type=int, default=2000)
+    writes.add_argument("--rooms", type=int, default=250)
+    writes.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    writes.set_defaults(run=sqlite_writes)
+
+    ingest = scenarios.add_parser("bulk_ingest", help="поштучное создание рейсов против массовой загрузки")
+    ingest.add_argument("--rows", type=int, default=200000)
+    ingest.add_argument("--single", type=int, default=500, help="сколько рейсов создать поштучно для сравнения")
+    ingest.set_defaults(run=bulk_ingest)
+
+    encoding = scenarios.add_parser("serialization", help="стоимость кодирования строки ответа со списком рейсов")
+    encoding.add_argument("--rows", type=int, default=20000)
+    encoding.add_argument("--repeat", type=int, default=5, help="берётся лучший из повторов")
+    encoding.set_defaults(run=serialization)
+
+    suite_parser = scenarios.add_parser("suite", help="набор сценариев на синтетических данных с сохранением в JSON")
+    suite_parser.add_argument("--size", choices=sorted(DATASET_SIZES), default="small")
+    suite_parser.add_argument("--seed", type=int, default=1)
+    suite_parser.add_argument("--requests", type=int, default=500, help="запросов на сценарий; для /token в 10 раз меньше")
+    suite_parser.add_argument("--concurrency", type=int, default=8)
+    suite_parser.add_argument("--warmup", type=int, default=20)
+    suite_parser.add_argument("--scenarios", nargs="+", choices=["available_rooms", "flights_search", "bookings_by_dates", "flights_book", "token"])
+    suite_parser.add_argument("--caches", action="store_true", help="не выключать кэши поиска и каталога")
+    suite_parser.add_argument("--output", help="файл для результата в JSON")
+    suite_parser.add_argument("--baseline", help="прежний результат для сравнения")
+    suite_parser.set_defaults(run=suite)
+
+    args = parser.parse_args()
+    return args.run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,594 +1,3219 @@
-# Определение моделей и базовых настроек
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from typing import List, Optional
-import uuid
-from sqlalchemy.sql import and_, or_
-from collections import defaultdict, deque
-from fastapi import Query
-
-SECRET_KEY = "your_secret_key"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-app = FastAPI()
-
-engine = create_engine('sqlite:///booking.db')
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-# Определение Pydantic-моделей
-class FlightOut(BaseModel):
-    id: int
-    departure_city: str
-    arrival_city: str
-    departure_time: datetime
-    arrival_time: datetime
-    price: float
-    available_seats: int
-
-    class Config:
-        from_attributes = True  
-
-class FlightSearchResult(BaseModel):
-    path: List[str]
-    flights: List[FlightOut]
-    total_price: float
-    total_time: float
-    category: str | None
-
-    class Config:
-        from_attributes = True  
-
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True)
-    name = Column(String)
-    hashed_password = Column(String)
-    role = Column(String, default="user")
-
-class Hotel(Base):
-    __tablename__ = "hotels"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String)
-    city = Column(String)
-    stars = Column(Integer)
-    rooms = relationship("Room", back_populates="hotel")
-
-class Room(Base):
-    __tablename__ = "rooms"
-    id = Column(Integer, primary_key=True, index=True)
-    hotel_id = Column(Integer, ForeignKey("hotels.id"))
-    type = Column(String)
-    rooms_count = Column(Integer)
-    price = Column(Float)
-    capacity = Column(Integer)
-    hotel = relationship("Hotel", back_populates="rooms")
-    bookings = relationship("Booking", back_populates="room")
-
-class Booking(Base):
-    __tablename__ = "bookings"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    room_id = Column(Integer, ForeignKey("rooms.id"))
-    check_in = Column(DateTime)
-    check_out = Column(DateTime)
-    user = relationship("User")
-    room = relationship("Room", back_populates="bookings")
-
-class Flight(Base):
-    __tablename__ = "flights"
-    id = Column(Integer, primary_key=True, index=True)
-    departure_city = Column(String)
-    arrival_city = Column(String)
-    departure_time = Column(DateTime)
-    arrival_time = Column(DateTime)
-    price = Column(Float)
-    total_seats = Column(Integer)
-    booked_seats = Column(Integer, default=0)
-
-Base.metadata.create_all(bind=engine)
-
-# Определение моделей для входных и выходных данных
-class UserCreate(BaseModel):
-    email: str
-    name: str
-    password: str
-    role: Optional[str] = "user"
-
-class UserUpdate(BaseModel):
-    name: str
-
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-class HotelCreate(BaseModel):
-    name: str
-    city: str
-    stars: int
-
-class HotelOut(BaseModel):
-    id: int
-    name: str
-    city: str
-    stars: int
-
-    class Config:
-        from_attributes = True  
-
-class RoomCreate(BaseModel):
-    hotel_id: int
-    type: str
-    rooms_count: int
-    price: float
-    capacity: int
-
-class RoomOut(BaseModel):
-    id: int
-    hotel_id: int
-    type: str
-    rooms_count: int
-    price: float
-    capacity: int
-
-    class Config:
-        from_attributes = True  
-
-class BookingCreate(BaseModel):
-    room_id: int
-    check_in: datetime
-    check_out: datetime
-
-class BookingOut(BaseModel):
-    id: int
-    user_id: int
-    room_id: int
-    check_in: datetime
-    check_out: datetime
-
-    class Config:
-        from_attributes = True  
-
-class FlightCreate(BaseModel):
-    departure_city: str
-    arrival_city: str
-    departure_time: datetime
-    arrival_time: datetime
-    price: float
-    total_seats: int
-
-class FlightSearch(BaseModel):
-    from_city: str
-    to_city: str
-    date_from: datetime
-    date_to: datetime
-    passengers: int = 1
-    via_city: Optional[str] = None
-
-# Определение зависимостей и утилит
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    password = password[:72]
-    return pwd_context.hash(password)
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
-
-async def get_current_admin(current_user: User = Depends(get_current_user)):
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-    return current_user
-
-# Утилиты для пользователей
-@app.post("/register")
-def register(user: UserCreate, db=Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
-    new_user = User(email=user.email, name=user.name, hashed_password=hashed_password, role=user.role)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return {"msg": "User created"}
-
-@app.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
-
-@app.put("/user/update")
-def update_user(update: UserUpdate, current_user: User = Depends(get_current_user), db=Depends(get_db)):
-    current_user.name = update.name
-    db.commit()
-    return {"msg": "Name updated"}
-
-# Утилиты для отелей
-@app.post("/hotels", response_model=HotelOut)
-def create_hotel(hotel: HotelCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    new_hotel = Hotel(**hotel.dict())
-    db.add(new_hotel)
-    db.commit()
-    db.refresh(new_hotel)
-    return new_hotel
-
-@app.get("/hotels", response_model=List[HotelOut])
-def get_hotels(city: Optional[str] = None, stars: Optional[int] = None, order_by_stars: Optional[str] = None, db=Depends(get_db)):
-    query = db.query(Hotel)
-    if city:
-        query = query.filter(Hotel.city == city)
-    if stars:
-        query = query.filter(Hotel.stars == stars)
-    if order_by_stars == "asc":
-        query = query.order_by(Hotel.stars)
-    elif order_by_stars == "desc":
-        query = query.order_by(Hotel.stars.desc())
-    return query.all()
-
-@app.put("/hotels/{hotel_id}", response_model=HotelOut)
-def update_hotel(hotel_id: int, hotel: HotelCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    db_hotel = db.query(Hotel).filter(Hotel.id == hotel_id).first()
-    if not db_hotel:
-        raise HTTPException(status_code=404, detail="Hotel not found")
-    for key, value in hotel.dict().items():
-        setattr(db_hotel, key, value)
-    db.commit()
-    db.refresh(db_hotel)
-    return db_hotel
-
-@app.delete("/hotels/{hotel_id}")
-def delete_hotel(hotel_id: int, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    db_hotel = db.query(Hotel).filter(Hotel.id == hotel_id).first()
-    if not db_hotel:
-        raise HTTPException(status_code=404, detail="Hotel not found")
-    db.delete(db_hotel)
-    db.commit()
-    return {"msg": "Hotel deleted"}
-
-# Утилиты для комнат
-@app.post("/rooms", response_model=RoomOut)
-def create_room(room: RoomCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    new_room = Room(**room.dict())
-    db.add(new_room)
-    db.commit()
-    db.refresh(new_room)
-    return new_room
-
-@app.get("/rooms", response_model=List[RoomOut])
-def get_rooms(hotel_id: Optional[int] = None, rooms_count: Optional[int] = None, type: Optional[str] = None, 
-              price_min: Optional[float] = None, price_max: Optional[float] = None, capacity: Optional[int] = None, 
-              order_by_price: Optional[str] = None, db=Depends(get_db)):
-    query = db.query(Room)
-    if hotel_id:
-        query = query.filter(Room.hotel_id == hotel_id)
-    if rooms_count:
-        query = query.filter(Room.rooms_count == rooms_count)
-    if type:
-        query = query.filter(Room.type == type)
-    if price_min:
-        query = query.filter(Room.price >= price_min)
-    if price_max:
-        query = query.filter(Room.price <= price_max)
-    if capacity:
-        query = query.filter(Room.capacity == capacity)
-    if order_by_price == "asc":
-        query = query.order_by(Room.price)
-    elif order_by_price == "desc":
-        query = query.order_by(Room.price.desc())
-    return query.all()
-
-@app.put("/rooms/{room_id}", response_model=RoomOut)
-def update_room(room_id: int, room: RoomCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    db_room = db.query(Room).filter(Room.id == room_id).first()
-    if not db_room:
-        raise HTTPException(status_code=404, detail="Room not found")
-    for key, value in room.dict().items():
-        setattr(db_room, key, value)
-    db.commit()
-    db.refresh(db_room)
-    return db_room
-
-@app.delete("/rooms/{room_id}")
-def delete_room(room_id: int, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    db_room = db.query(Room).filter(Room.id == room_id).first()
-    if not db_room:
-        raise HTTPException(status_code=404, detail="Room not found")
-    db.delete(db_room)
-    db.commit()
-    return {"msg": "Room deleted"}
-
-# Утилиты для бронирования
-def is_room_available(db, room_id, check_in, check_out):
-    overlapping = db.query(Booking).filter(
-        Booking.room_id == room_id,
-        or_(
-            and_(Booking.check_in < check_out, Booking.check_out > check_in)
-        )
-    ).count()
-    return overlapping == 0
-
-@app.post("/bookings/by_dates", response_model=BookingOut)
-def book_by_dates(booking: BookingCreate, current_user: User = Depends(get_current_user), db=Depends(get_db)):
-    if not is_room_available(db, booking.room_id, booking.check_in, booking.check_out):
-        raise HTTPException(status_code=400, detail="Room not available")
-    new_booking = Booking(user_id=current_user.id, room_id=booking.room_id, check_in=booking.check_in, check_out=booking.check_out)
-    db.add(new_booking)
-    db.commit()
-    db.refresh(new_booking)
-    return new_booking
-
-@app.post("/bookings/by_days")
-def book_by_days(room_id: int, check_in: datetime, days: int, current_user: User = Depends(get_current_user), db=Depends(get_db)):
-    check_out = check_in + timedelta(days=days)
-    if not is_room_available(db, room_id, check_in, check_out):
-        raise HTTPException(status_code=400, detail="Room not available")
-    new_booking = Booking(user_id=current_user.id, room_id=room_id, check_in=check_in, check_out=check_out)
-    db.add(new_booking)
-    db.commit()
-    db.refresh(new_booking)
-    return new_booking
-
-@app.get("/available_rooms", response_model=List[RoomOut])
-def get_available_rooms(
-    check_in: datetime,
-    check_out: datetime,
-    hotel_id: Optional[int] = None,
-    type: Optional[str] = None,
-    price_min: Optional[float] = None,
-    price_max: Optional[float] = None,
-    capacity: Optional[int] = None,
-    order_by_price: Optional[str] = None,
-    db=Depends(get_db)
-):
-    query = db.query(Room)
-    
-    if hotel_id is not None:
-        query = query.filter(Room.hotel_id == hotel_id)
-    
-    if type is not None:
-        query = query.filter(Room.type == type)
-    
-    if price_min is not None:
-        query = query.filter(Room.price >= price_min)
-    if price_max is not None:
-        query = query.filter(Room.price <= price_max)
-    
-    if capacity is not None:
-        query = query.filter(Room.capacity == capacity)
-    
-    rooms = query.all()
-    available_rooms = []
-    
-    for room in rooms:
-        if is_room_available(db, room.id, check_in, check_out):
-            available_rooms.append(room)
-    
-    if order_by_price == "asc":
-        available_rooms.sort(key=lambda x: x.price)
-    elif order_by_price == "desc":
-        available_rooms.sort(key=lambda x: x.price, reverse=True)
-    
-    return available_rooms
-
-@app.delete("/bookings/{booking_id}")
-def cancel_booking(booking_id: int, current_user: User = Depends(get_current_user), db=Depends(get_db)):
-    booking = db.query(Booking).filter(Booking.id == booking_id).first()
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    if current_user.role != "admin" and booking.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-    db.delete(booking)
-    db.commit()
-    return {"msg": "Booking canceled"}
-
-# Утилиты маршрутов для рейсов
-@app.post("/flights", response_model=FlightOut)
-def create_flight(flight: FlightCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    new_flight = Flight(**flight.dict(), booked_seats=0)
-    db.add(new_flight)
-    db.commit()
-    db.refresh(new_flight)
-    return FlightOut(**new_flight.__dict__, available_seats=new_flight.total_seats - new_flight.booked_seats)
-
-@app.get("/flights", response_model=List[FlightOut])
-def get_flights(db=Depends(get_db)):
-    flights = db.query(Flight).all()
-    return [FlightOut(**f.__dict__, available_seats=f.total_seats - f.booked_seats) for f in flights]
-
-@app.put("/flights/{flight_id}", response_model=FlightOut)
-def update_flight(flight_id: int, flight: FlightCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    db_flight = db.query(Flight).filter(Flight.id == flight_id).first()
-    if not db_flight:
-        raise HTTPException(status_code=404, detail="Flight not found")
-    for key, value in flight.dict().items():
-        setattr(db_flight, key, value)
-    db.commit()
-    db.refresh(db_flight)
-    return FlightOut(**db_flight.__dict__, available_seats=db_flight.total_seats - db_flight.booked_seats)
-
-@app.delete("/flights/{flight_id}")
-def delete_flight(flight_id: int, admin: User = Depends(get_current_admin), db=Depends(get_db)):
-    db_flight = db.query(Flight).filter(Flight.id == flight_id).first()
-    if not db_flight:
-        raise HTTPException(status_code=404, detail="Flight not found")
-    db.delete(db_flight)
-    db.commit()
-    return {"msg": "Flight deleted"}
-
-# Функция поиска путей
-def find_shortest_paths(db, from_city, to_city, date_from, date_to, passengers, via_city=None):
-    all_flights = db.query(Flight).filter(
-        Flight.departure_time >= date_from,
-        Flight.departure_time <= date_to,
-        Flight.total_seats - Flight.booked_seats >= passengers
-    ).all()
-    
-    graph = {}
-    for f in all_flights:
-        if f.departure_city not in graph:
-            graph[f.departure_city] = []
-        graph[f.departure_city].append(f)
-    
-    queue = deque([([from_city], [], 0)])
-    visited = set()
-    paths = []
-    
-    while queue:
-        path, flights, total_time = queue.popleft()
-        current = path[-1]
-        if current == to_city:
-            if via_city and via_city not in path:
-                continue
-            paths.append((path, flights, total_time))
-            continue
-        
-        if current in visited:
-            continue
-        visited.add(current)
-        
-        if current not in graph:
-            continue
-        
-        for flight in sorted(graph[current], key=lambda f: f.departure_time):
-            if flight.arrival_city in path:
-                continue
-            layover = 0
-            if flights:
-                prev_arrival = flights[-1].arrival_time
-                if flight.departure_time - prev_arrival > timedelta(hours=24):
-                    continue
-                layover = (flight.departure_time - prev_arrival).total_seconds() / 3600
-            new_total_time = total_time + (flight.arrival_time - flight.departure_time).total_seconds() / 3600 + layover
-            queue.append((path + [flight.arrival_city], flights + [flight], new_total_time))
-    
-    if not paths:
-        return []
-    
-    results = []
-    for path, flights, total_time in paths:
-        total_price = sum(f.price for f in flights)
-        results.append({
-            "path": path,
-            "flights": [FlightOut(**f.__dict__, available_seats=f.total_seats - f.booked_seats) for f in flights],
-            "total_price": total_price,
-            "total_time": total_time,
-            "category": None
-        })
-    
-    return results
-
-# Утилита для поиска рейсов
-@app.post("/flights/search", response_model=List[FlightSearchResult])
-def search_flights(
-    search_data: FlightSearch,
-    order_by: Optional[str] = Query(None, description="Sort by: price_asc, price_desc"),
-    order_by_time: Optional[str] = Query(None, description="Sort by: time_asc, time_desc"),
-    db=Depends(get_db)
-):
-    from_city = search_data.from_city
-    to_city = search_data.to_city
-    date_from = search_data.date_from
-    date_to = search_data.date_to
-    passengers = search_data.passengers
-    via_city = search_data.via_city
-
-    results = find_shortest_paths(db, from_city, to_city, date_from, date_to, passengers, via_city)
-
-    if results:
-        fastest_time = min(r["total_time"] for r in results)
-        cheapest_price = min(r["total_price"] for r in results)
-        for result in results:
-            if result["total_time"] == fastest_time:
-                result["category"] = "fastest"
-            elif result["total_price"] == cheapest_price:
-                result["category"] = "cheapest"
-
-    if order_by_time:
-        if order_by_time == "time_asc":
-            results.sort(key=lambda x: x["flights"][0].departure_time if x["flights"] else datetime.max)
-        elif order_by_time == "time_desc":
-            results.sort(key=lambda x: x["flights"][0].departure_time if x["flights"] else datetime.min, reverse=True)
-    elif order_by:
-        if order_by == "price_asc":
-            results.sort(key=lambda x: x["total_price"])
-        elif order_by == "price_desc":
-            results.sort(key=lambda x: x["total_price"], reverse=True)
-    else:
-        def sort_key(item):
-            if item["category"] == "fastest":
-                return (0, item["total_price"])
-            elif item["category"] == "cheapest":
-                return (1, item["total_price"])
-            else:
-                return (2, item["total_price"])
-        results.sort(key=sort_key)
-
-    return results
-
-#Утилита для бронирования билетов
-@app.post("/flights/book/{flight_id}")
-def book_flight(flight_id: int, passengers: int, current_user: User = Depends(get_current_user), db=Depends(get_db)):
-    flight = db.query(Flight).filter(Flight.id == flight_id).first()
-    if not flight:
-        raise HTTPException(status_code=404, detail="Flight not found")
-    if flight.total_seats - flight.booked_seats < passengers:
-        raise HTTPException(status_code=400, detail="Not enough seats")
-    flight.booked_seats += passengers
-    db.commit()
-    return {"msg": "Flight booked"}
\ No newline at end of file
+# Определение моделей и базовых настроек
+from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, Boolean, Index, event, func, insert, select, update, delete, literal
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import aliased, sessionmaker, relationship
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, model_validator
+from datetime import date, datetime, timedelta, timezone
+from jose import JWTError, jwt
+from typing import List, Optional
+import uuid
+from sqlalchemy.sql import and_, or_, tuple_
+from collections import OrderedDict, defaultdict, deque
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate
+import asyncio
+import base64
+import binascii
+import codecs
+import csv
+import hashlib
+import heapq
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from email.utils import format_datetime, parsedate_to_datetime
+from passwords import BCRYPT_ROUNDS, get_password_hash, timed_password_call
+
+# orjson необязателен: без него ответы кодируются стандартным json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SECRET_KEY = "your_secret_key"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Индекс броней живёт в памяти одного процесса: при нескольких воркерах его нужно выключить
+BOOKING_INDEX_ENABLED = os.getenv("BOOKING_INDEX_ENABLED", "0") == "1"
+# Кэш ответов каталога: число разных запросов в памяти и время жизни записи в секундах
+# Версии таблиц живут в процессе: при нескольких воркерах кэш и ETag нужно выключить
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "1") == "1"
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1000"))
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))
+# Кэш результатов поиска рейсов; как и версии каталога, живёт в процессе
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") == "1"
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2000"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "60"))
+# Запросы дольше порога (мс) пишутся в лог вместе со списком SQL; 0 — не писать
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# Массовая загрузка: строк в одной транзакции и сколько ошибок по строкам возвращать в ответе
+BULK_BATCH_SIZE = 2000
+BULK_MAX_ERRORS = 100
+# Постраничный вывод каталога: максимальный размер страницы и размер пачки при потоковой выдаче
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+# Календарь занятости: максимальная длина диапазона в днях
+MAX_CALENDAR_DAYS = 366
+# Гибкий поиск рейсов: максимальный сдвиг окна в днях в каждую сторону
+MAX_FLEXIBLE_DAYS = 15
+MIN_LAYOVER_MINUTES = 0
+MAX_LAYOVER_MINUTES = 24 * 60
+MAX_FLIGHT_LEGS = 4
+# Расписание рейсов в памяти процесса; при нескольких воркерах его нужно выключить
+FLIGHT_TIMETABLE_ENABLED = os.getenv("FLIGHT_TIMETABLE_ENABLED", "1") == "1"
+# Сколько раз перечитывать снимок расписания, если его сбросила массовая загрузка, прежде чем искать запросом к БД
+TIMETABLE_LOAD_ATTEMPTS = 3
+# Индекс автодополнения отелей в памяти процесса; при нескольких воркерах его нужно выключить
+HOTEL_AUTOCOMPLETE_ENABLED = os.getenv("HOTEL_AUTOCOMPLETE_ENABLED", "1") == "1"
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_LOAD_ATTEMPTS = 3
+# Архивация истории: завершённые брони и вылетевшие рейсы старше ARCHIVE_AFTER_DAYS дней; интервал 0 — без фоновой задачи
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "1"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))
+# Асинхронный доступ к БД через aiosqlite для горячих эндпоинтов
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB_ENABLED", "0") == "1"
+# Хеширование паролей: число процессов (0 — в потоке запроса), глубина очереди и стоимость bcrypt
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", "64"))
+# Аутентификация по данным токена; STRICT_AUTH=1 — проверять пользователя в БД на каждом запросе
+STRICT_AUTH = os.getenv("STRICT_AUTH", "0") == "1"
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+# Хранилище: адрес БД и профиль (tuned — WAL и настройки SQLite для параллельной нагрузки, plain — как у драйвера)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///booking.db")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+STORAGE_PROFILE = os.getenv("STORAGE_PROFILE", "tuned")
+# Пул соединений под пул потоков FastAPI (40 потоков)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "40"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+# Фоновая архивация (ARCHIVE_INTERVAL_SECONDS > 0) работает, пока запущено приложение
+@asynccontextmanager
+async def lifespan(app):
+    stop = start_archiver()
+    yield
+    if stop is not None:
+        stop.set()
+
+app = FastAPI(lifespan=lifespan)
+
+def engine_options(url):
+    url = make_url(url)
+    if STORAGE_PROFILE != "tuned" or (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+
+def configure_storage(sync_engine):
+    if STORAGE_PROFILE != "tuned" or sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Транзакции открывает событие begin, а не драйвер: так запись может начинаться с BEGIN IMMEDIATE
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+        cursor.close()
+
+    @event.listens_for(sync_engine, "begin")
+    def begin_sqlite_transaction(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("sqlite_immediate") else "BEGIN")
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+configure_storage(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if ASYNC_DB_ENABLED:
+    # Асинхронный режим требует aiosqlite и greenlet, поэтому импорт только при включении
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+    configure_storage(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    async_engine = None
+    AsyncSessionLocal = None
+
+# Инструментирование запросов: SQL и время в БД собираются событиями движка в статистику текущего запроса
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+SLOW_QUERY_LOG_LIMIT = 50
+logger = logging.getLogger("booking")
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds", "queries", "bcrypt_seconds", "search_nodes")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.queries = []
+        self.bcrypt_seconds = 0.0
+        self.search_nodes = 0
+
+    def add_query(self, statement, elapsed):
+        self.sql_count += 1
+        self.sql_seconds += elapsed
+        if len(self.queries) < SLOW_QUERY_LOG_LIMIT:
+            self.queries.append((" ".join(statement.split())[:300], elapsed))
+
+# Middleware кладёт статистику в контекст; пул потоков и задачи копируют контекст, поэтому она видна везде в запросе
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+def note_bcrypt(seconds):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.bcrypt_seconds += seconds
+
+def note_search_nodes(count):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.search_nodes += count
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        stats = current_request_stats.get()
+        if started is not None and stats is not None:
+            stats.add_query(statement, time.perf_counter() - started)
+
+instrument_engine(engine)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
+
+class RouteMetrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.slow = 0
+
+    def record(self, route, elapsed_ms, status_code, stats, slow=False):
+        bucket = bisect_left(self.buckets, elapsed_ms)
+        with self._lock:
+            self.slow += slow
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {
+                    "count": 0, "errors": 0, "histogram": [0] * (len(self.buckets) + 1), "total_ms": 0.0, "max_ms": 0.0,
+                    "sql_count": 0, "sql_ms": 0.0, "bcrypt_ms": 0.0, "search_nodes": 0,
+                }
+            entry["count"] += 1
+            entry["errors"] += status_code >= 500
+            entry["histogram"][bucket] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["sql_count"] += stats.sql_count
+            entry["sql_ms"] += stats.sql_seconds * 1000
+            entry["bcrypt_ms"] += stats.bcrypt_seconds * 1000
+            entry["search_nodes"] += stats.search_nodes
+
+    # Перцентиль по гистограмме: верхняя граница корзины, в которую он попадает
+    def _percentile(self, histogram, count, fraction):
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (None,), histogram):
+            seen += bucket_count
+            if seen >= count * fraction:
+                return bound
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            routes = {route: dict(entry, histogram=list(entry["histogram"])) for route, entry in self._routes.items()}
+            slow = self.slow
+        result = {}
+        for route, entry in sorted(routes.items()):
+            count = entry["count"]
+            result[route] = {
+                "count": count,
+                "errors": entry["errors"],
+                "avg_ms": round(entry["total_ms"] / count, 2),
+                "max_ms": round(entry["max_ms"], 2),
+                "p50_ms_le": self._percentile(entry["histogram"], count, 0.5),
+                "p95_ms_le": self._percentile(entry["histogram"], count, 0.95),
+                "p99_ms_le": self._percentile(entry["histogram"], count, 0.99),
+                "histogram_ms": dict(zip([str(bound) for bound in self.buckets] + ["inf"], entry["histogram"])),
+                "sql_per_request": round(entry["sql_count"] / count, 2),
+                "db_ms_per_request": round(entry["sql_ms"] / count, 2),
+                "bcrypt_ms_total": round(entry["bcrypt_ms"], 2),
+                "search_nodes_per_request": round(entry["search_nodes"] / count, 1),
+            }
+        return {"slow_request_ms": SLOW_REQUEST_MS, "slow_requests": slow, "routes": result}
+
+request_metrics = RouteMetrics(LATENCY_BUCKETS_MS)
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    stats = RequestStats()
+    token = current_request_stats.set(stats)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        current_request_stats.reset(token)
+        # Метрики группируются по шаблону маршрута, а не по конкретному пути с id
+        route = request.scope.get("route")
+        name = f"{request.method} {route.path if route is not None else 'unmatched'}"
+        slow = bool(SLOW_REQUEST_MS) and elapsed_ms >= SLOW_REQUEST_MS
+        request_metrics.record(name, elapsed_ms, status_code, stats, slow)
+        if slow:
+            logger.warning(
+                "slow request %s %s: %.1f ms, status %s, %d SQL in %.1f ms, bcrypt %.1f ms, search nodes %d%s",
+                request.method, request.url.path, elapsed_ms, status_code, stats.sql_count, stats.sql_seconds * 1000,
+                stats.bcrypt_seconds * 1000, stats.search_nodes,
+                "".join(f"\n  {elapsed * 1000:.2f} ms  {statement}" for statement, elapsed in stats.queries),
+            )
+
+Base = declarative_base()
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+# Определение Pydantic-моделей
+class FlightOut(BaseModel):
+    id: int
+    departure_city: str
+    arrival_city: str
+    departure_time: datetime
+    arrival_time: datetime
+    price: float
+    available_seats: int
+
+    class Config:
+        from_attributes = True  
+
+class FlightSearchResult(BaseModel):
+    path: List[str]
+    flights: List[FlightOut]
+    total_price: float
+    total_time: float
+    category: str | None
+
+    class Config:
+        from_attributes = True  
+
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, unique=True, index=True)
+    name = Column(String)
+    hashed_password = Column(String)
+    role = Column(String, default="user")
+
+class Hotel(Base):
+    __tablename__ = "hotels"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String)
+    city = Column(String)
+    stars = Column(Integer)
+    rooms = relationship("Room", back_populates="hotel")
+    __table_args__ = (Index("ix_hotels_city_stars", "city", "stars"),)
+
+class Room(Base):
+    __tablename__ = "rooms"
+    id = Column(Integer, primary_key=True, index=True)
+    hotel_id = Column(Integer, ForeignKey("hotels.id"))
+    type = Column(String)
+    rooms_count = Column(Integer)
+    price = Column(Float)
+    capacity = Column(Integer)
+    hotel = relationship("Hotel", back_populates="rooms")
+    bookings = relationship("Booking", back_populates="room")
+    __table_args__ = (Index("ix_rooms_hotel_price", "hotel_id", "price"),)
+
+class Booking(Base):
+    __tablename__ = "bookings"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    room_id = Column(Integer, ForeignKey("rooms.id"))
+    check_in = Column(DateTime)
+    check_out = Column(DateTime)
+    user = relationship("User")
+    room = relationship("Room", back_populates="bookings")
+    # Покрывающий индекс для подсчёта пересекающихся броней комнаты; индекс по check_out — для архивации
+    __table_args__ = (
+        Index("ix_bookings_room_dates", "room_id", "check_in", "check_out"),
+        Index("ix_bookings_check_out", "check_out"),
+    )
+
+class Flight(Base):
+    __tablename__ = "flights"
+    id = Column(Integer, primary_key=True, index=True)
+    departure_city = Column(String)
+    arrival_city = Column(String)
+    departure_time = Column(DateTime)
+    arrival_time = Column(DateTime)
+    price = Column(Float)
+    total_seats = Column(Integer)
+    booked_seats = Column(Integer, default=0)
+    __table_args__ = (Index("ix_flights_departure", "departure_time", "departure_city"),)
+
+# Сводка минимальных тарифов: по каждому направлению и дню вылета — минимальная цена, самый ранний вылет
+# и число рейсов со свободными местами. Ключ начинается с города вылета, поэтому /flights/explore — один поиск по индексу
+class FareSummary(Base):
+    __tablename__ = "fare_summary"
+    departure_city = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    arrival_city = Column(String, primary_key=True)
+    min_price = Column(Float)
+    earliest_departure = Column(DateTime)
+    flights = Column(Integer)
+
+# Архив: те же колонки без внешних ключей. SQLite может повторно выдать id после удаления последней строки,
+# поэтому у архивных записей свой ключ, а исходный id хранится отдельно
+class BookingArchive(Base):
+    __tablename__ = "bookings_archive"
+    archive_id = Column(Integer, primary_key=True)
+    id = Column(Integer, index=True)
+    user_id = Column(Integer)
+    room_id = Column(Integer)
+    check_in = Column(DateTime)
+    check_out = Column(DateTime)
+    archived_at = Column(DateTime)
+
+class FlightArchive(Base):
+    __tablename__ = "flights_archive"
+    archive_id = Column(Integer, primary_key=True)
+    id = Column(Integer, index=True)
+    departure_city = Column(String)
+    arrival_city = Column(String)
+    departure_time = Column(DateTime)
+    arrival_time = Column(DateTime)
+    price = Column(Float)
+    total_seats = Column(Integer)
+    booked_seats = Column(Integer)
+    archived_at = Column(DateTime)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime)
+
+# Версионные миграции: create_all создаёт только новые таблицы, изменения существующей БД вносятся здесь
+def migrate_hot_query_indexes(connection):
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_bookings_room_dates ON bookings (room_id, check_in, check_out)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_flights_departure ON flights (departure_time, departure_city)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_rooms_hotel_price ON rooms (hotel_id, price)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_hotels_city_stars ON hotels (city, stars)")
+
+# Сводка пересчитывается запросами INSERT ... SELECT: целиком при миграции и массовой загрузке,
+# по затронутым (город вылета, день) при изменении отдельных рейсов
+FARE_SUMMARY_COLUMNS = ("departure_city", "arrival_city", "day", "min_price", "earliest_departure", "flights")
+
+def fare_summary_rows(departure_city, day):
+    return select(
+        departure_city, Flight.arrival_city, day,
+        func.min(Flight.price), func.min(Flight.departure_time), func.count(Flight.id)
+    ).where(Flight.total_seats > Flight.booked_seats)
+
+def rebuild_fare_summary(connection):
+    connection.execute(delete(FareSummary))
+    day = func.date(Flight.departure_time)
+    connection.execute(insert(FareSummary).from_select(
+        FARE_SUMMARY_COLUMNS,
+        fare_summary_rows(Flight.departure_city, day).group_by(Flight.departure_city, Flight.arrival_city, day)
+    ))
+
+def refresh_fare_summary(connection, keys):
+    for departure_city, day in sorted(keys):
+        start = datetime.combine(day, datetime.min.time())
+        connection.execute(delete(FareSummary).where(FareSummary.departure_city == departure_city, FareSummary.day == day))
+        connection.execute(insert(FareSummary).from_select(
+            FARE_SUMMARY_COLUMNS,
+            fare_summary_rows(literal(departure_city), literal(day, Date)).where(
+                Flight.departure_city == departure_city,
+                Flight.departure_time >= start,
+                Flight.departure_time < start + timedelta(days=1),
+            ).group_by(Flight.arrival_city)
+        ))
+
+def fare_key(flight):
+    return flight.departure_city, flight.departure_time.date()
+
+# После бронирования сводка меняется, только если рейс распродан: он выпадает из минимума своего дня
+def refresh_sold_out_fares(connection, flight_ids):
+    sold_out = connection.execute(select(Flight.departure_city, Flight.departure_time).where(
+        Flight.id.in_(list(flight_ids)), Flight.booked_seats >= Flight.total_seats
+    )).all()
+    if sold_out:
+        refresh_fare_summary(connection, {fare_key(flight) for flight in sold_out})
+
+# Удаление отелей и комнат через ORM раньше обнуляло ссылки вместо каскада: брони таких комнат
+# переносятся в архив, как при обычной архивации, а сами комнаты удаляются
+def migrate_archive(connection):
+    BookingArchive.__table__.create(connection, checkfirst=True)
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_bookings_check_out ON bookings (check_out)")
+    orphaned_rooms = select(Room.id).where(Room.hotel_id.is_(None))
+    orphaned = or_(Booking.room_id.is_(None), Booking.room_id.in_(orphaned_rooms))
+    columns = list(Booking.__table__.columns)
+    connection.execute(insert(BookingArchive).from_select(
+        [column.name for column in columns] + ["archived_at"],
+        select(*columns, literal(datetime.utcnow(), DateTime)).where(orphaned)
+    ))
+    connection.execute(delete(Booking).where(orphaned))
+    connection.execute(delete(Room).where(Room.hotel_id.is_(None)))
+
+MIGRATIONS = [
+    (1, "Indexes for availability, flight search and catalog filters", migrate_hot_query_indexes),
+    (2, "Cheapest fare summary per route and day", rebuild_fare_summary),
+    (3, "History archive tables; orphaned bookings moved to the archive", migrate_archive),
+]
+
+def apply_migrations(bind):
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        # Версия перепроверяется под блокировкой записи, чтобы параллельный запуск не применил её дважды
+        with bind.connect() as connection:
+            connection = connection.execution_options(sqlite_immediate=True)
+            with connection.begin():
+                if connection.execute(select(SchemaMigration.version).where(SchemaMigration.version == version)).first():
+                    continue
+                migrate(connection)
+                connection.execute(SchemaMigration.__table__.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                ))
+                applied.append(version)
+    return applied
+
+Base.metadata.create_all(bind=engine)
+apply_migrations(engine)
+
+# Определение моделей для входных и выходных данных
+class UserCreate(BaseModel):
+    email: str
+    name: str
+    password: str
+    role: Optional[str] = "user"
+
+class UserUpdate(BaseModel):
+    name: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+
+class Principal(BaseModel):
+    id: int
+    email: str
+    role: str
+
+class HotelCreate(BaseModel):
+    name: str
+    city: str
+    stars: int
+
+class HotelOut(BaseModel):
+    id: int
+    name: str
+    city: str
+    stars: int
+
+    class Config:
+        from_attributes = True  
+
+class RoomCreate(BaseModel):
+    hotel_id: int
+    type: str
+    rooms_count: int
+    price: float
+    capacity: int
+
+class RoomOut(BaseModel):
+    id: int
+    hotel_id: int
+    type: str
+    rooms_count: int
+    price: float
+    capacity: int
+
+    class Config:
+        from_attributes = True  
+
+class BookingCreate(BaseModel):
+    room_id: int
+    check_in: datetime
+    check_out: datetime
+
+class BookingOut(BaseModel):
+    id: int
+    user_id: int
+    room_id: int
+    check_in: datetime
+    check_out: datetime
+
+    class Config:
+        from_attributes = True  
+
+class FlightCreate(BaseModel):
+    departure_city: str
+    arrival_city: str
+    departure_time: datetime
+    arrival_time: datetime
+    price: float
+    total_seats: int
+
+class ItineraryBooking(BaseModel):
+    flight_ids: List[int]
+    passengers: int = 1
+
+class TripBooking(BaseModel):
+    flight_ids: List[int] = []
+    passengers: int = 1
+    rooms: List[BookingCreate] = []
+
+class TripOut(BaseModel):
+    flights: List[FlightOut]
+    bookings: List[BookingOut]
+
+class RoomCalendar(BaseModel):
+    room_id: int
+    hotel_id: int
+    type: str
+    rooms_count: int
+    free: List[int]
+
+class OccupancyCalendar(BaseModel):
+    date_from: date
+    date_to: date
+    days: List[date]
+    rooms: List[RoomCalendar]
+
+class FlightSearch(BaseModel):
+    from_city: str
+    to_city: str
+    date_from: datetime
+    date_to: datetime
+    passengers: int = 1
+    via_city: Optional[str] = None
+    min_layover_minutes: int = Field(MIN_LAYOVER_MINUTES, ge=0)
+    max_layover_minutes: int = Field(MAX_LAYOVER_MINUTES, ge=0)
+    max_legs: int = Field(MAX_FLIGHT_LEGS, ge=1, le=MAX_FLIGHT_LEGS)
+    # Для /flights/search/flexible: на сколько дней сдвигать окно вылета в каждую сторону
+    flexible_days: int = 0
+
+    @model_validator(mode="after")
+    def check_layovers(self):
+        if self.max_layover_minutes < self.min_layover_minutes:
+            raise ValueError("max_layover_minutes must not be less than min_layover_minutes")
+        return self
+
+class FlexibleSearchResult(FlightSearchResult):
+    date: date
+
+class ExploreResult(BaseModel):
+    arrival_city: str
+    day: date
+    min_price: float
+    earliest_departure: datetime
+    flights: int
+
+    class Config:
+        from_attributes = True
+
+# Определение зависимостей и утилит
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Транзакция с проверкой и записью сразу берёт блокировку записи: чтение не придётся повышать до записи
+def begin_write(db):
+    if db.in_transaction():
+        db.commit()
+    db.connection(execution_options={"sqlite_immediate": True})
+
+async def begin_write_async(db):
+    if db.in_transaction():
+        await db.commit()
+    await db.connection(execution_options={"sqlite_immediate": True})
+
+# Пул процессов для bcrypt: хеширование не держит GIL процесса сервера;
+# процессы импортируют только passwords.py, а не приложение
+class PasswordHasher:
+    def __init__(self, workers, queue_depth):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {"completed": 0, "rejected": 0, "queue_wait_total": 0.0, "queue_wait_max": 0.0,
+                       "hash_time_total": 0.0, "hash_time_max": 0.0}
+
+    def _acquire(self):
+        with self._lock:
+            # Все места заняты: запрос сразу отклоняется, а не ждёт в очереди
+            if self._in_flight >= max(self.workers, 1) + self.queue_depth:
+                self._stats["rejected"] += 1
+                raise HTTPException(status_code=503, detail="Password hashing is overloaded",
+                                    headers={"Retry-After": "1"})
+            self._in_flight += 1
+            if self.workers and self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _release(self, submitted, outcome):
+        result, started, elapsed = outcome
+        with self._lock:
+            self._in_flight -= 1
+            wait = max(0.0, started - submitted)
+            self._stats["completed"] += 1
+            self._stats["queue_wait_total"] += wait
+            self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], wait)
+            self._stats["hash_time_total"] += elapsed
+            self._stats["hash_time_max"] = max(self._stats["hash_time_max"], elapsed)
+        note_bcrypt(elapsed)
+        return result
+
+    def _fail(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def call(self, name, *args):
+        self._acquire()
+        submitted = time.time()
+        try:
+            if self._executor is None:
+                outcome = timed_password_call(name, *args)
+            else:
+                outcome = self._executor.submit(timed_password_call, name, *args).result()
+        except BaseException:
+            self._fail()
+            raise
+        return self._release(submitted, outcome)
+
+    async def call_async(self, name, *args):
+        self._acquire()
+        submitted = time.time()
+        try:
+            if self._executor is None:
+                outcome = await run_in_threadpool(timed_password_call, name, *args)
+            else:
+                outcome = await asyncio.wrap_future(self._executor.submit(timed_password_call, name, *args))
+        except BaseException:
+            self._fail()
+            raise
+        return self._release(submitted, outcome)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        completed = stats["completed"] or 1
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "in_flight": in_flight,
+            "completed": stats["completed"],
+            "rejected": stats["rejected"],
+            "queue_wait_avg_ms": round(stats["queue_wait_total"] / completed * 1000, 2),
+            "queue_wait_max_ms": round(stats["queue_wait_max"] * 1000, 2),
+            "hash_time_avg_ms": round(stats["hash_time_total"] / completed * 1000, 2),
+            "hash_time_max_ms": round(stats["hash_time_max"] * 1000, 2),
+        }
+
+password_hasher = PasswordHasher(HASH_WORKERS, HASH_QUEUE_DEPTH)
+
+# LRU-кэш с ограничением размера и временем жизни записей
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at=None):
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[key] = (value, deadline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses}
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def create_user_token(user):
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.email, "uid": user.id, "role": user.role, "iat": int(time.time())},
+        expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+def decode_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload.get("sub") is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    return payload
+
+# Проверенные пользователи по токену; изменение пользователя делает устаревшими выданные раньше данные
+principal_cache = LRUCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_user_changed_at = {}
+
+def invalidate_principal(user_id):
+    _user_changed_at[user_id] = time.time()
+
+def principal_is_fresh(user_id, verified_at):
+    return _user_changed_at.get(user_id, 0) < verified_at
+
+# Пользователь из кэша или из данных токена; None — нужна проверка по БД
+def principal_from_token(token):
+    if STRICT_AUTH:
+        return None, decode_token(token)
+    entry = principal_cache.get(token)
+    if entry is not None:
+        principal, verified_at = entry
+        if principal_is_fresh(principal.id, verified_at):
+            return principal, None
+    payload = decode_token(token)
+    uid, role, issued_at = payload.get("uid"), payload.get("role"), payload.get("iat")
+    if uid is None or role is None or issued_at is None or not principal_is_fresh(uid, issued_at):
+        return None, payload
+    principal = Principal(id=uid, email=payload["sub"], role=role)
+    principal_cache.set(token, (principal, issued_at), expires_at=payload.get("exp"))
+    return principal, None
+
+def remember_principal(token, user, payload):
+    if user is None:
+        raise credentials_exception
+    principal = Principal(id=user.id, email=user.email, role=user.role)
+    if not STRICT_AUTH:
+        principal_cache.set(token, (principal, time.time()), expires_at=payload.get("exp"))
+    return principal
+
+# Пользователь загружается без блокировки цикла событий: в потоке пула или через асинхронную сессию
+if ASYNC_DB_ENABLED:
+    async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_async_db)):
+        principal, payload = principal_from_token(token)
+        if principal is None:
+            user = (await db.scalars(select(User).where(User.email == payload["sub"]))).first()
+            principal = remember_principal(token, user, payload)
+        return principal
+else:
+    def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
+        principal, payload = principal_from_token(token)
+        if principal is None:
+            user = db.query(User).filter(User.email == payload["sub"]).first()
+            principal = remember_principal(token, user, payload)
+        return principal
+
+async def get_current_admin(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return current_user
+
+# Утилиты для пользователей
+@app.post("/register")
+def register(user: UserCreate, db=Depends(get_db)):
+    db_user = db.query(User).filter(User.email == user.email).first()
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = password_hasher.call("hash", user.password)
+    new_user = User(email=user.email, name=user.name, hashed_password=hashed_password, role=user.role)
+    db.add(new_user)
+    db.commit()
+    db.refresh(new_user)
+    return {"msg": "User created"}
+
+@app.post("/token", response_model=Token)
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get_db)):
+    user = db.query(User).filter(User.email == form_data.username).first()
+    if not user or not password_hasher.call("verify", form_data.password, user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return create_user_token(user)
+
+@app.put("/user/update")
+def update_user(update: UserUpdate, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    db.query(User).filter(User.id == current_user.id).update({"name": update.name})
+    db.commit()
+    invalidate_principal(current_user.id)
+    return {"msg": "Name updated"}
+
+@app.get("/metrics")
+def get_metrics(admin: User = Depends(get_current_admin)):
+    return {
+        "password_hashing": password_hasher.snapshot(),
+        "auth_cache": principal_cache.stats(),
+        "catalog_cache": dict(catalog_cache.stats(), not_modified=catalog_versions.not_modified),
+        "search_cache": search_cache.stats(),
+        "requests": request_metrics.snapshot(),
+    }
+
+# Утилиты постраничного вывода: курсор хранит порядок сортировки и ключ последней строки страницы
+def encode_cursor(order, values):
+    data = json.dumps({"order": order, "after": values}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def decode_cursor(cursor, order, size):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Ключ сортировки — только скаляры: вложенные списки и объекты из подделанного курсора не дойдут до SQL
+    if not isinstance(data, dict) or data.get("order") != order or not isinstance(data.get("after"), list) \
+            or len(data["after"]) != size \
+            or not all(value is None or isinstance(value, (str, int, float)) for value in data["after"]):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return data["after"]
+
+def keyset_order(columns, descending):
+    return [column.desc() for column in columns] if descending else list(columns)
+
+# Страница по ключу: строки после курсора в порядке сортировки, на одну больше лимита, чтобы узнать о продолжении
+def keyset_page(statement, order, columns, descending, cursor, limit):
+    if cursor is not None:
+        after = decode_cursor(cursor, order, len(columns))
+        key = tuple_(*columns)
+        statement = statement.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    return statement
+
+# Быстрый путь ответа: готовые dict из выбранных колонок кодируются сразу, без повторной проверки response_model
+def json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def json_bytes(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+def json_response(content, headers=None):
+    return Response(content=json_bytes(content), media_type="application/json", headers=headers)
+
+def row_dicts(rows):
+    return [row._asdict() for row in rows]
+
+def page_rows(rows, order, columns, limit):
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(order, [getattr(rows[-1], column.key) for column in columns])
+    return rows, None
+
+# Версии таблиц каталога: изменение таблицы меняет её версию, а с ней ETag и ключи кэша ответов
+class CatalogVersions:
+    def __init__(self, tables):
+        self._lock = threading.Lock()
+        # Метка запуска процесса: после перезапуска версии начинаются заново, но старые ETag не совпадут
+        self.boot = uuid.uuid4().hex[:8]
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        self._versions = {table: (0, now) for table in tables}
+        self.not_modified = 0
+
+    def get(self, table):
+        with self._lock:
+            return self._versions[table]
+
+    # Вызывается после коммита изменения
+    def bump(self, *tables):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for table in tables:
+                self._versions[table] = (self._versions[table][0] + 1, now)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+catalog_versions = CatalogVersions(("hotels", "rooms", "flights"))
+catalog_cache = LRUCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+# Last-Modified точен до секунды, поэтому он отдаётся и сравнивается с If-Modified-Since, только когда секунда
+# последнего изменения уже прошла: изменение в ту же секунду после ответа иначе дало бы устаревший 304.
+# До этого клиент сверяется по ETag
+def modified_is_settled(modified):
+    return modified < datetime.now(timezone.utc).replace(microsecond=0)
+
+def not_modified(request, etag, modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return modified_is_settled(modified) and modified <= since
+    return False
+
+# Ответ каталога с ETag и Last-Modified: 304 и попадание в кэш обходятся без запроса к БД
+# Без adapter load возвращает готовые dict, и они кодируются напрямую
+def encode_items(items, adapter):
+    if adapter is None:
+        return json_bytes(items)
+    return adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+
+def catalog_response(request, table, load, adapter=None):
+    if not CATALOG_CACHE_ENABLED:
+        items, next_cursor = load()
+        headers = {} if next_cursor is None else {"X-Next-Cursor": next_cursor}
+        return Response(content=encode_items(items, adapter), media_type="application/json", headers=headers)
+    version, modified = catalog_versions.get(table)
+    params = tuple(sorted(request.query_params.multi_items()))
+    digest = hashlib.sha1(repr((catalog_versions.boot, table, version, params)).encode()).hexdigest()[:20]
+    headers = {"ETag": f'"{digest}"'}
+    if modified_is_settled(modified):
+        headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+    if not_modified(request, headers["ETag"], modified):
+        catalog_versions.count_not_modified()
+        return Response(status_code=304, headers=headers)
+    key = (table, version, params)
+    entry = catalog_cache.get(key)
+    if entry is None:
+        items, next_cursor = load()
+        entry = (encode_items(items, adapter), next_cursor)
+        catalog_cache.set(key, entry)
+    body, next_cursor = entry
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Потоковая выдача NDJSON: строки читаются пачками из курсора БД в своей сессии, память не растёт с размером таблицы.
+# serialize получает ORM-объект и возвращает модель; без него строки выбранных колонок кодируются как есть
+def stream_ndjson(statement, serialize=None):
+    def generate():
+        db = SessionLocal()
+        try:
+            batched = statement.execution_options(yield_per=STREAM_BATCH_SIZE)
+            if serialize is None:
+                for row in db.execute(batched):
+                    yield json_bytes(row._asdict()) + b"\n"
+            else:
+                for row in db.scalars(batched):
+                    yield serialize(row).model_dump_json() + "\n"
+        finally:
+            db.close()
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+# Автодополнение отелей: нормализованные ключи (регистр, диакритика, пунктуация) в отсортированных массивах
+NON_WORD = re.compile(r"[\W_]+")
+
+def normalize_text(value):
+    value = value or ""
+    if not value.isascii():
+        value = "".join(ch for ch in unicodedata.normalize("NFKD", value) if not unicodedata.combining(ch))
+    return " ".join(NON_WORD.sub(" ", value).casefold().split())
+
+# Ключи с начала каждого слова: "Grand Hotel Paris" находится и по "gra", и по "hotel p", и по "par"
+def word_starts(text):
+    words = text.split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+class HotelAutocomplete:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.loaded = False
+        self._epoch = 0
+        self._loading = False
+        self._lock = threading.Lock()
+        # Строит индекс один запрос, остальные ждут его результата
+        self._build_lock = threading.Lock()
+        # id -> (название, город, звёзды, ключи)
+        self._hotels = {}
+        # Отдельный отсортированный массив (ключ, id) на каждое число звёзд: поиск идёт от лучших отелей
+        # и останавливается, набрав limit, поэтому не зависит от числа совпадений
+        self._keys = {}
+        self._levels = []
+        # Изменения, закоммиченные во время построения: id -> (название, город, звёзды) или None для удалённого
+        self._pending = {}
+
+    def ensure_loaded(self, db):
+        if self.loaded:
+            return True
+        with self._build_lock:
+            for _ in range(AUTOCOMPLETE_LOAD_ATTEMPTS):
+                if self.loaded:
+                    break
+                epoch = self.begin_load()
+                rows = None
+                try:
+                    rows = db.execute(select(Hotel.id, Hotel.name, Hotel.city, Hotel.stars)).all()
+                finally:
+                    self.load(rows, epoch)
+        return self.loaded
+
+    def begin_load(self):
+        with self._lock:
+            self._loading = True
+            return self._epoch
+
+    # Массивы строятся без блокировки и подменяются целиком; снимок устаревает только после reset,
+    # изменения, пришедшие за время построения, применяются поверх него
+    def load(self, rows, epoch):
+        hotels = {}
+        levels = {}
+        for row in rows or ():
+            keys = self._hotel_keys(row.name, row.city)
+            hotels[row.id] = (row.name, row.city, row.stars, keys)
+            level_keys = levels.setdefault(self._level(row.stars), [])
+            for key in keys:
+                level_keys.append((key, row.id))
+        for level_keys in levels.values():
+            level_keys.sort()
+        with self._lock:
+            self._loading = False
+            if rows is not None and not self.loaded and self._epoch == epoch:
+                self._hotels = hotels
+                self._keys = levels
+                self._levels = sorted(levels, reverse=True)
+                for hotel_id, hotel in self._pending.items():
+                    self._remove(hotel_id)
+                    if hotel is not None:
+                        self._insert(hotel_id, *hotel)
+                self.loaded = True
+            self._pending.clear()
+            return self.loaded
+
+    def reset(self):
+        with self._lock:
+            self._epoch += 1
+            self.loaded = False
+            self._hotels.clear()
+            self._keys.clear()
+            self._levels = []
+            self._pending.clear()
+
+    @staticmethod
+    def _level(stars):
+        return -1 if stars is None else stars
+
+    @staticmethod
+    def _hotel_keys(name, city):
+        return sorted(set(word_starts(normalize_text(name)) + word_starts(normalize_text(city))))
+
+    def _insert(self, hotel_id, name, city, stars):
+        keys = self._hotel_keys(name, city)
+        self._hotels[hotel_id] = (name, city, stars, keys)
+        level = self._level(stars)
+        if level not in self._keys:
+            self._keys[level] = []
+            self._levels = sorted(self._keys, reverse=True)
+        for key in keys:
+            insort(self._keys[level], (key, hotel_id))
+
+    def _remove(self, hotel_id):
+        hotel = self._hotels.pop(hotel_id, None)
+        if hotel is None:
+            return
+        level_keys = self._keys[self._level(hotel[2])]
+        for key in hotel[3]:
+            del level_keys[bisect_left(level_keys, (key, hotel_id))]
+
+    # Изменения применяются после коммита. Пока индекс не загружен, они нужны только идущему построению:
+    # его снимок мог быть прочитан до коммита
+    def upsert(self, hotel):
+        with self._lock:
+            if self.loaded:
+                self._remove(hotel.id)
+                self._insert(hotel.id, hotel.name, hotel.city, hotel.stars)
+            elif self._loading:
+                self._pending[hotel.id] = (hotel.name, hotel.city, hotel.stars)
+
+    def remove(self, hotel_id):
+        with self._lock:
+            if self.loaded:
+                self._remove(hotel_id)
+            elif self._loading:
+                self._pending[hotel_id] = None
+
+    def lookup(self, query, limit):
+        prefix = normalize_text(query)
+        results = []
+        if not prefix:
+            return results
+        seen = set()
+        with self._lock:
+            for level in self._levels:
+                keys = self._keys[level]
+                position = bisect_left(keys, (prefix,))
+                while position < len(keys) and keys[position][0].startswith(prefix):
+                    hotel_id = keys[position][1]
+                    position += 1
+                    if hotel_id in seen:
+                        continue
+                    seen.add(hotel_id)
+                    name, city, stars, _ = self._hotels[hotel_id]
+                    results.append({"id": hotel_id, "name": name, "city": city, "stars": stars})
+                    if len(results) >= limit:
+                        return results
+        return results
+
+hotel_autocomplete = HotelAutocomplete(enabled=HOTEL_AUTOCOMPLETE_ENABLED)
+
+# Утилиты для отелей
+@app.post("/hotels", response_model=HotelOut)
+def create_hotel(hotel: HotelCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    new_hotel = Hotel(**hotel.dict())
+    db.add(new_hotel)
+    db.commit()
+    catalog_versions.bump("hotels")
+    db.refresh(new_hotel)
+    hotel_autocomplete.upsert(new_hotel)
+    return new_hotel
+
+# Без индекса в памяти: поиск по началу названия или города в БД, без нормализации диакритики
+def autocomplete_statement(query, limit):
+    prefix = query.strip().lower()
+    return select(Hotel).where(or_(
+        func.lower(Hotel.name).like(f"{prefix}%"),
+        func.lower(Hotel.name).like(f"% {prefix}%"),
+        func.lower(Hotel.city).like(f"{prefix}%"),
+    )).order_by(Hotel.stars.desc(), Hotel.name, Hotel.id).limit(limit)
+
+@app.get("/hotels/autocomplete", response_model=List[HotelOut])
+def autocomplete_hotels(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=AUTOCOMPLETE_MAX_LIMIT),
+                        db=Depends(get_db)):
+    if not hotel_autocomplete.enabled or not hotel_autocomplete.ensure_loaded(db):
+        return db.scalars(autocomplete_statement(q, limit)).all()
+    return json_response(hotel_autocomplete.lookup(q, limit))
+
+HOTELS_JSON = TypeAdapter(List[HotelOut])
+
+def hotels_keyset(order_by_stars=None):
+    if order_by_stars in ("asc", "desc"):
+        return f"stars_{order_by_stars}", (Hotel.stars, Hotel.id), order_by_stars == "desc"
+    return "id", (Hotel.id,), False
+
+def hotels_statement(city=None, stars=None, order_by_stars=None):
+    query = select(Hotel)
+    if city:
+        query = query.where(Hotel.city == city)
+    if stars:
+        query = query.where(Hotel.stars == stars)
+    order, columns, descending = hotels_keyset(order_by_stars)
+    return query.order_by(*keyset_order(columns, descending))
+
+@app.get("/hotels", response_model=List[HotelOut])
+def get_hotels(request: Request, city: Optional[str] = None, stars: Optional[int] = None, order_by_stars: Optional[str] = None,
+               cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+               stream: bool = False, db=Depends(get_db)):
+    order, columns, descending = hotels_keyset(order_by_stars)
+    statement = keyset_page(hotels_statement(city, stars, order_by_stars), order, columns, descending, cursor, limit)
+    if stream:
+        return stream_ndjson(statement, HotelOut.model_validate)
+    return catalog_response(request, "hotels", lambda: page_rows(db.scalars(statement).all(), order, columns, limit), HOTELS_JSON)
+
+@app.put("/hotels/{hotel_id}", response_model=HotelOut)
+def update_hotel(hotel_id: int, hotel: HotelCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    db_hotel = db.query(Hotel).filter(Hotel.id == hotel_id).first()
+    if not db_hotel:
+        raise HTTPException(status_code=404, detail="Hotel not found")
+    for key, value in hotel.dict().items():
+        setattr(db_hotel, key, value)
+    db.commit()
+    catalog_versions.bump("hotels")
+    db.refresh(db_hotel)
+    hotel_autocomplete.upsert(db_hotel)
+    return db_hotel
+
+# Отель удаляется вместе с комнатами и их бронями: три DELETE по индексам, без загрузки объектов
+@app.delete("/hotels/{hotel_id}")
+def delete_hotel(hotel_id: int, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    begin_write(db)
+    if db.execute(select(Hotel.id).where(Hotel.id == hotel_id)).first() is None:
+        raise HTTPException(status_code=404, detail="Hotel not found")
+    room_ids = db.scalars(select(Room.id).where(Room.hotel_id == hotel_id)).all()
+    db.execute(delete(Booking).where(Booking.room_id.in_(select(Room.id).where(Room.hotel_id == hotel_id))))
+    db.execute(delete(Room).where(Room.hotel_id == hotel_id))
+    db.execute(delete(Hotel).where(Hotel.id == hotel_id))
+    db.commit()
+    for room_id in room_ids:
+        booking_index.drop_room(room_id)
+    hotel_autocomplete.remove(hotel_id)
+    catalog_versions.bump("hotels", "rooms")
+    return {"msg": "Hotel deleted"}
+
+# Утилиты для комнат
+@app.post("/rooms", response_model=RoomOut)
+def create_room(room: RoomCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    new_room = Room(**room.dict())
+    db.add(new_room)
+    db.commit()
+    catalog_versions.bump("rooms")
+    db.refresh(new_room)
+    return new_room
+
+# Колонки ответа RoomOut: списки комнат выбирают только их и отдаются без ORM-объектов
+ROOM_OUT_COLUMNS = (Room.id, Room.hotel_id, Room.type, Room.rooms_count, Room.price, Room.capacity)
+
+def rooms_keyset(order_by_price=None):
+    if order_by_price in ("asc", "desc"):
+        return f"price_{order_by_price}", (Room.price, Room.id), order_by_price == "desc"
+    return "id", (Room.id,), False
+
+def rooms_statement(hotel_id=None, rooms_count=None, type=None, price_min=None, price_max=None, capacity=None,
+                    order_by_price=None):
+    query = select(*ROOM_OUT_COLUMNS)
+    if hotel_id:
+        query = query.where(Room.hotel_id == hotel_id)
+    if rooms_count:
+        query = query.where(Room.rooms_count == rooms_count)
+    if type:
+        query = query.where(Room.type == type)
+    if price_min:
+        query = query.where(Room.price >= price_min)
+    if price_max:
+        query = query.where(Room.price <= price_max)
+    if capacity:
+        query = query.where(Room.capacity == capacity)
+    order, columns, descending = rooms_keyset(order_by_price)
+    return query.order_by(*keyset_order(columns, descending))
+
+@app.get("/rooms", response_model=List[RoomOut])
+def get_rooms(request: Request, hotel_id: Optional[int] = None, rooms_count: Optional[int] = None, type: Optional[str] = None, 
+              price_min: Optional[float] = None, price_max: Optional[float] = None, capacity: Optional[int] = None, 
+              order_by_price: Optional[str] = None, cursor: Optional[str] = None,
+              limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), stream: bool = False, db=Depends(get_db)):
+    order, columns, descending = rooms_keyset(order_by_price)
+    statement = keyset_page(
+        rooms_statement(hotel_id, rooms_count, type, price_min, price_max, capacity, order_by_price),
+        order, columns, descending, cursor, limit
+    )
+    if stream:
+        return stream_ndjson(statement)
+
+    def load():
+        rooms, next_cursor = page_rows(db.execute(statement).all(), order, columns, limit)
+        return row_dicts(rooms), next_cursor
+
+    return catalog_response(request, "rooms", load)
+
+@app.put("/rooms/{room_id}", response_model=RoomOut)
+def update_room(room_id: int, room: RoomCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    # Комната выгружается из индекса броней под той же блокировкой записи, что берут бронирования, и до коммита:
+    # следующее бронирование перечитает её из БД уже с новым rooms_count
+    begin_write(db)
+    db_room = db.query(Room).filter(Room.id == room_id).first()
+    if not db_room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    for key, value in room.dict().items():
+        setattr(db_room, key, value)
+    db.flush()
+    booking_index.drop_room(room_id)
+    db.commit()
+    db.refresh(db_room)
+    catalog_versions.bump("rooms")
+    return db_room
+
+@app.delete("/rooms/{room_id}")
+def delete_room(room_id: int, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    begin_write(db)
+    if db.execute(select(Room.id).where(Room.id == room_id)).first() is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    db.execute(delete(Booking).where(Booking.room_id == room_id))
+    db.execute(delete(Room).where(Room.id == room_id))
+    db.commit()
+    booking_index.drop_room(room_id)
+    catalog_versions.bump("rooms")
+    return {"msg": "Room deleted"}
+
+# Индекс броней в памяти
+class RoomIntervals:
+    def __init__(self, rooms_count, bookings):
+        self.rooms_count = rooms_count or 0
+        self.bookings = {}
+        self.check_ins = []
+        self.check_outs = []
+        for booking_id, check_in, check_out in bookings:
+            self.bookings[booking_id] = (check_in, check_out)
+            self.check_ins.append(check_in)
+            self.check_outs.append(check_out)
+        self.check_ins.sort()
+        self.check_outs.sort()
+
+    def add(self, booking_id, check_in, check_out):
+        if booking_id in self.bookings:
+            return
+        self.bookings[booking_id] = (check_in, check_out)
+        insort(self.check_ins, check_in)
+        insort(self.check_outs, check_out)
+
+    def remove(self, booking_id):
+        interval = self.bookings.pop(booking_id, None)
+        if interval is None:
+            return
+        check_in, check_out = interval
+        del self.check_ins[bisect_left(self.check_ins, check_in)]
+        del self.check_outs[bisect_left(self.check_outs, check_out)]
+
+    def peak(self, check_in, check_out):
+        # Наибольшее число одновременных броней на [check_in, check_out): занятость в момент check_in,
+        # затем проход по заездам внутри диапазона с учётом выездов до каждого из них
+        starts = bisect_right(self.check_ins, check_in)
+        ends = bisect_right(self.check_outs, check_in)
+        current = peak = starts - ends
+        last_start = bisect_left(self.check_ins, check_out)
+        while starts < last_start:
+            moment = self.check_ins[starts]
+            while self.check_outs[ends] <= moment:
+                current -= 1
+                ends += 1
+            current += 1
+            starts += 1
+            if current > peak:
+                peak = current
+        return peak
+
+
+class RoomBookingIndex:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._rooms = {}
+        self._epochs = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def epoch(self, room_id):
+        with self._lock:
+            return self._epochs[room_id]
+
+    def load_room(self, room_id, rooms_count, bookings, epoch):
+        intervals = RoomIntervals(rooms_count, bookings)
+        with self._lock:
+            # Если за время чтения из БД бронь уже изменилась, снимок устарел
+            if self._epochs[room_id] != epoch:
+                return False
+            self._rooms.setdefault(room_id, intervals)
+            return True
+
+    def free_units(self, room_id, check_in, check_out):
+        with self._lock:
+            intervals = self._rooms.get(room_id)
+            if intervals is None:
+                return None
+            return intervals.rooms_count - intervals.peak(check_in, check_out)
+
+    def add_booking(self, room_id, booking_id, check_in, check_out):
+        with self._lock:
+            self._epochs[room_id] += 1
+            intervals = self._rooms.get(room_id)
+            if intervals is not None:
+                intervals.add(booking_id, check_in, check_out)
+
+    def remove_booking(self, room_id, booking_id):
+        with self._lock:
+            self._epochs[room_id] += 1
+            intervals = self._rooms.get(room_id)
+            if intervals is not None:
+                intervals.remove(booking_id)
+
+    def drop_room(self, room_id):
+        with self._lock:
+            self._epochs[room_id] += 1
+            self._rooms.pop(room_id, None)
+
+    def snapshot(self):
+        with self._lock:
+            return {room_id: (intervals.rooms_count, dict(intervals.bookings)) for room_id, intervals in self._rooms.items()}
+
+booking_index = RoomBookingIndex(enabled=BOOKING_INDEX_ENABLED)
+
+def room_intervals_statements(room_id):
+    return (
+        select(Room.rooms_count).where(Room.id == room_id),
+        select(Booking.id, Booking.check_in, Booking.check_out).where(Booking.room_id == room_id),
+    )
+
+def load_room_into_index(db, room_id):
+    epoch = booking_index.epoch(room_id)
+    room_statement, bookings_statement = room_intervals_statements(room_id)
+    room = db.execute(room_statement).first()
+    if room is None:
+        return False
+    return booking_index.load_room(room_id, room.rooms_count, db.execute(bookings_statement).all(), epoch)
+
+async def load_room_into_index_async(db, room_id):
+    epoch = booking_index.epoch(room_id)
+    room_statement, bookings_statement = room_intervals_statements(room_id)
+    room = (await db.execute(room_statement)).first()
+    if room is None:
+        return False
+    return booking_index.load_room(room_id, room.rooms_count, (await db.execute(bookings_statement)).all(), epoch)
+
+def check_booking_index(db):
+    mismatched = []
+    for room_id, (rooms_count, bookings) in booking_index.snapshot().items():
+        room = db.query(Room.rooms_count).filter(Room.id == room_id).first()
+        rows = db.query(Booking.id, Booking.check_in, Booking.check_out).filter(Booking.room_id == room_id).all()
+        if room is None or (room.rooms_count or 0) != rooms_count or {r.id: (r.check_in, r.check_out) for r in rows} != bookings:
+            mismatched.append(room_id)
+    return mismatched
+
+# Утилиты для бронирования
+def overlapping_bookings_filter(check_in, check_out):
+    return and_(Booking.check_in < check_out, Booking.check_out > check_in)
+
+# Комната свободна, если пик одновременных броней на диапазоне меньше rooms_count: брони, не пересекающиеся
+# друг с другом, занимают одну и ту же единицу. Пик достигается в check_in или в момент заезда одной из
+# пересекающихся броней, поэтому достаточно посчитать брони, покрывающие каждый такой момент
+STARTED_BOOKING = aliased(Booking, name="started")
+
+def peak_bookings(room_id, check_in, check_out):
+    started = STARTED_BOOKING
+    moment = func.max(started.check_in, check_in)
+    concurrent = select(func.count(Booking.id)).where(
+        Booking.room_id == started.room_id, Booking.check_in <= moment, Booking.check_out > moment
+    ).scalar_subquery()
+    return select(func.coalesce(func.max(concurrent), 0)).where(
+        started.room_id == room_id, started.check_in < check_out, started.check_out > check_in
+    ).scalar_subquery()
+
+def room_availability_statement(room_id, check_in, check_out):
+    return select(Room.rooms_count, peak_bookings(Room.id, check_in, check_out).label("booked")).where(Room.id == room_id)
+
+def room_has_free_units(room):
+    return room is not None and room.booked < (room.rooms_count or 0)
+
+def is_room_available(db, room_id, check_in, check_out):
+    if booking_index.enabled:
+        free = booking_index.free_units(room_id, check_in, check_out)
+        if free is None and load_room_into_index(db, room_id):
+            free = booking_index.free_units(room_id, check_in, check_out)
+        if free is not None:
+            return free > 0
+    return room_has_free_units(db.execute(room_availability_statement(room_id, check_in, check_out)).first())
+
+async def is_room_available_async(db, room_id, check_in, check_out):
+    if booking_index.enabled:
+        free = booking_index.free_units(room_id, check_in, check_out)
+        if free is None and await load_room_into_index_async(db, room_id):
+            free = booking_index.free_units(room_id, check_in, check_out)
+        if free is not None:
+            return free > 0
+    return room_has_free_units((await db.execute(room_availability_statement(room_id, check_in, check_out))).first())
+
+# Новые брони попадают в индекс до коммита, пока ещё держится блокировка записи: следующая проверка
+# доступности уже видит их. Если коммит не удался, брони убираются из индекса
+def booking_entries(bookings):
+    return [(booking.room_id, booking.id, booking.check_in, booking.check_out) for booking in bookings]
+
+def index_bookings(entries):
+    for room_id, booking_id, check_in, check_out in entries:
+        booking_index.add_booking(room_id, booking_id, check_in, check_out)
+
+def unindex_bookings(entries):
+    for room_id, booking_id, check_in, check_out in entries:
+        booking_index.remove_booking(room_id, booking_id)
+
+def commit_bookings(db, bookings):
+    db.flush()
+    entries = booking_entries(bookings)
+    index_bookings(entries)
+    try:
+        db.commit()
+    except Exception:
+        unindex_bookings(entries)
+        raise
+
+async def commit_bookings_async(db, bookings):
+    await db.flush()
+    entries = booking_entries(bookings)
+    index_bookings(entries)
+    try:
+        await db.commit()
+    except Exception:
+        unindex_bookings(entries)
+        raise
+
+def validate_booking_dates(check_in, check_out):
+    if check_out <= check_in:
+        raise HTTPException(status_code=400, detail="Check-out must be after check-in")
+
+@app.post("/bookings/by_dates", response_model=BookingOut)
+def book_by_dates(booking: BookingCreate, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    validate_booking_dates(booking.check_in, booking.check_out)
+    begin_write(db)
+    if not is_room_available(db, booking.room_id, booking.check_in, booking.check_out):
+        raise HTTPException(status_code=400, detail="Room not available")
+    new_booking = Booking(user_id=current_user.id, room_id=booking.room_id, check_in=booking.check_in, check_out=booking.check_out)
+    db.add(new_booking)
+    commit_bookings(db, [new_booking])
+    db.refresh(new_booking)
+    return new_booking
+
+@app.post("/bookings/by_days")
+def book_by_days(room_id: int, check_in: datetime, days: int, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    check_out = check_in + timedelta(days=days)
+    validate_booking_dates(check_in, check_out)
+    begin_write(db)
+    if not is_room_available(db, room_id, check_in, check_out):
+        raise HTTPException(status_code=400, detail="Room not available")
+    new_booking = Booking(user_id=current_user.id, room_id=room_id, check_in=check_in, check_out=check_out)
+    db.add(new_booking)
+    commit_bookings(db, [new_booking])
+    db.refresh(new_booking)
+    return new_booking
+
+def available_rooms_statement(check_in, check_out, hotel_id=None, type=None, price_min=None, price_max=None,
+                              capacity=None, order_by_price=None, limit=None, offset=0):
+    # Пик занятости считается коррелированным подзапросом по индексу броней только для комнат,
+    # прошедших остальные фильтры
+    query = select(*ROOM_OUT_COLUMNS)
+
+    if hotel_id is not None:
+        query = query.where(Room.hotel_id == hotel_id)
+
+    if type is not None:
+        query = query.where(Room.type == type)
+
+    if price_min is not None:
+        query = query.where(Room.price >= price_min)
+    if price_max is not None:
+        query = query.where(Room.price <= price_max)
+
+    if capacity is not None:
+        query = query.where(Room.capacity == capacity)
+
+    query = query.where(peak_bookings(Room.id, check_in, check_out) < Room.rooms_count)
+
+    if order_by_price == "asc":
+        query = query.order_by(Room.price, Room.id)
+    elif order_by_price == "desc":
+        query = query.order_by(Room.price.desc(), Room.id)
+    else:
+        query = query.order_by(Room.id)
+
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query
+
+@app.get("/available_rooms", response_model=List[RoomOut])
+def get_available_rooms(
+    check_in: datetime,
+    check_out: datetime,
+    hotel_id: Optional[int] = None,
+    type: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    capacity: Optional[int] = None,
+    order_by_price: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    db=Depends(get_db)
+):
+    return json_response(row_dicts(db.execute(available_rooms_statement(
+        check_in, check_out, hotel_id, type, price_min, price_max, capacity, order_by_price, limit, offset
+    ))))
+
+# Календарь занятости: свободные комнаты каждого типа по дням. День занят бронью, если она пересекает
+# сутки [день, день + 1) — так же, как /available_rooms с этими границами
+def calendar_rooms_statement(hotel_id=None, city=None):
+    query = select(Room.id, Room.hotel_id, Room.type, Room.rooms_count)
+    if hotel_id is not None:
+        query = query.where(Room.hotel_id == hotel_id)
+    if city is not None:
+        query = query.where(Room.hotel_id.in_(select(Hotel.id).where(Hotel.city == city)))
+    return query.order_by(Room.hotel_id, Room.id)
+
+def calendar_bookings_statement(rooms, start, end):
+    return select(Booking.room_id, Booking.check_in, Booking.check_out).where(
+        Booking.room_id.in_(rooms.with_only_columns(Room.id).order_by(None)),
+        overlapping_bookings_filter(start, end)
+    )
+
+# Пик одновременных броней за каждый день, как у /available_rooms на границах этого дня. Занятость на начало
+# дня для всех комнат сразу даёт один разностный массив (строка на комнату) и накопленная сумма по нему.
+# Внутри дня пик растёт только на заездах, поэтому перебираются лишь заезды и выезды внутри суток. Каждое такое
+# событие — одно целое число (ячейка дня, микросекунды от начала дня, признак заезда): список сортируется без
+# кортежей, выезд идёт раньше заезда в тот же момент
+def occupancy_sweep(rooms, bookings, start, days):
+    day = timedelta(days=1)
+    tick = timedelta(microseconds=1)
+    shift = (day // tick).bit_length() + 1
+    bounds = [start + day * offset for offset in range(days + 1)]
+    width = days + 1
+    rows = {room.id: index * width for index, room in enumerate(rooms)}
+    diffs = [0] * (len(rooms) * width)
+    events = []
+    for room_id, check_in, check_out in bookings:
+        row = rows.get(room_id)
+        if row is None:
+            continue
+        # Номер первой границы дня не раньше заезда и выезда: бронь занимает комнату на начало дней [first, last)
+        first = bisect_left(bounds, check_in)
+        last = bisect_left(bounds, check_out)
+        if 0 < first <= days and bounds[first] != check_in:
+            events.append((row + first - 1) << shift | (check_in - bounds[first - 1]) // tick << 1 | 1)
+        if 0 < last <= days and bounds[last] != check_out:
+            events.append((row + last - 1) << shift | (check_out - bounds[last - 1]) // tick << 1)
+        if last > days:
+            last = days
+        if first < last:
+            diffs[row + first] += 1
+            diffs[row + last] -= 1
+    peaks = list(accumulate(diffs))
+    events.sort()
+    cell = None
+    current = 0
+    for event in events:
+        if event >> shift != cell:
+            cell = event >> shift
+            current = peaks[cell]
+        if event & 1:
+            current += 1
+            if current > peaks[cell]:
+                peaks[cell] = current
+        else:
+            current -= 1
+    calendar = []
+    for room in rooms:
+        row = rows[room.id]
+        count = room.rooms_count or 0
+        calendar.append((room, [count - booked if booked < count else 0 for booked in peaks[row:row + days]]))
+    return calendar
+
+@app.get("/occupancy_calendar", response_model=OccupancyCalendar)
+def get_occupancy_calendar(
+    date_from: date,
+    date_to: date,
+    hotel_id: Optional[int] = None,
+    city: Optional[str] = None,
+    db=Depends(get_db)
+):
+    if hotel_id is None and city is None:
+        raise HTTPException(status_code=400, detail="hotel_id or city is required")
+    days = (date_to - date_from).days + 1
+    if days < 1:
+        raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+    if days > MAX_CALENDAR_DAYS:
+        raise HTTPException(status_code=400, detail=f"Calendar range is limited to {MAX_CALENDAR_DAYS} days")
+    start = datetime.combine(date_from, datetime.min.time())
+    end = start + timedelta(days=days)
+    rooms_query = calendar_rooms_statement(hotel_id, city)
+    rooms = db.execute(rooms_query).all()
+    bookings = db.execute(calendar_bookings_statement(rooms_query, start, end)).all() if rooms else []
+    return json_response({
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "days": [(date_from + timedelta(days=offset)).isoformat() for offset in range(days)],
+        "rooms": [
+            {"room_id": room.id, "hotel_id": room.hotel_id, "type": room.type, "rooms_count": room.rooms_count, "free": free}
+            for room, free in occupancy_sweep(rooms, bookings, start, days)
+        ],
+    })
+
+@app.delete("/bookings/{booking_id}")
+def cancel_booking(booking_id: int, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    booking = db.query(Booking).filter(Booking.id == booking_id).first()
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if current_user.role != "admin" and booking.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    db.delete(booking)
+    db.commit()
+    booking_index.remove_booking(booking.room_id, booking.id)
+    return {"msg": "Booking canceled"}
+
+@app.get("/bookings/index/check")
+def check_booking_index_consistency(repair: bool = False, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    if not booking_index.enabled:
+        return {"enabled": False, "rooms_loaded": 0, "mismatched": []}
+    mismatched = check_booking_index(db)
+    if repair:
+        for room_id in mismatched:
+            booking_index.drop_room(room_id)
+    return {"enabled": True, "rooms_loaded": len(booking_index.snapshot()), "mismatched": mismatched}
+
+# Расписание рейсов в памяти
+EPOCH = datetime(1970, 1, 1)
+
+def to_seconds(moment):
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - EPOCH).total_seconds()
+
+class TimetableFlight:
+    __slots__ = ("id", "departure_city", "arrival_city", "departure_time", "arrival_time",
+                 "price", "total_seats", "booked_seats", "departure", "arrival", "connection")
+
+    def __init__(self, f):
+        self.id = f.id
+        self.departure_city = f.departure_city
+        self.arrival_city = f.arrival_city
+        self.departure_time = f.departure_time
+        self.arrival_time = f.arrival_time
+        self.price = f.price
+        self.total_seats = f.total_seats
+        self.booked_seats = f.booked_seats or 0
+        self.departure = to_seconds(f.departure_time)
+        self.arrival = to_seconds(f.arrival_time)
+        self.connection = (self.departure, self.arrival, self.id, self)
+
+class FlightTimetable:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.loaded = False
+        self._epoch = 0
+        self._loading = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+        # Вылеты по городам, отсортированные по (время вылета, id)
+        self._keys = defaultdict(list)
+        self._departures = defaultdict(list)
+        # Изменения, закоммиченные во время чтения снимка: id -> запись или None для удалённого рейса
+        self._pending = {}
+        self._pending_seats = {}
+
+    def begin_load(self):
+        with self._lock:
+            self._loading += 1
+            return self._epoch
+
+    def ensure_loaded(self, db):
+        for _ in range(TIMETABLE_LOAD_ATTEMPTS):
+            if self.loaded:
+                break
+            epoch = self.begin_load()
+            rows = None
+            try:
+                rows = db.execute(timetable_statement()).all()
+            finally:
+                self.load(rows, epoch)
+        return self.loaded
+
+    async def ensure_loaded_async(self, db):
+        for _ in range(TIMETABLE_LOAD_ATTEMPTS):
+            if self.loaded:
+                break
+            epoch = self.begin_load()
+            rows = None
+            try:
+                rows = (await db.execute(timetable_statement())).all()
+            finally:
+                self.load(rows, epoch)
+        return self.loaded
+
+    # Снимок устаревает только после reset; изменения, пришедшие во время чтения, применяются поверх него
+    def load(self, rows, epoch):
+        with self._lock:
+            self._loading -= 1
+            if rows is not None and not self.loaded and self._epoch == epoch:
+                for row in rows:
+                    record = TimetableFlight(row)
+                    self._flights[record.id] = record
+                    self._departures[record.departure_city].append(record)
+                for city, departures in self._departures.items():
+                    departures.sort(key=lambda r: (r.departure, r.id))
+                    self._keys[city] = [(r.departure, r.id) for r in departures]
+                for flight_id, record in self._pending.items():
+                    self._apply(flight_id, record)
+                for flight_id, booked_seats in self._pending_seats.items():
+                    self._set_booked_seats(flight_id, booked_seats)
+                self.loaded = True
+            if self.loaded or not self._loading:
+                self._pending.clear()
+                self._pending_seats.clear()
+            return self.loaded
+
+    def reset(self):
+        with self._lock:
+            self._epoch += 1
+            self.loaded = False
+            self._flights.clear()
+            self._keys.clear()
+            self._departures.clear()
+            self._pending.clear()
+            self._pending_seats.clear()
+
+    def _insert(self, record):
+        keys = self._keys[record.departure_city]
+        position = bisect_left(keys, (record.departure, record.id))
+        keys.insert(position, (record.departure, record.id))
+        self._departures[record.departure_city].insert(position, record)
+        self._flights[record.id] = record
+
+    def _remove(self, flight_id):
+        record = self._flights.pop(flight_id, None)
+        if record is None:
+            return None
+        keys = self._keys[record.departure_city]
+        position = bisect_left(keys, (record.departure, record.id))
+        del keys[position]
+        del self._departures[record.departure_city][position]
+        return record
+
+    def _apply(self, flight_id, record):
+        previous = self._remove(flight_id)
+        if record is None:
+            return
+        if previous is not None:
+            # Число проданных мест только растёт: не откатываемся к более старому значению
+            record.booked_seats = max(record.booked_seats, previous.booked_seats)
+        self._insert(record)
+
+    def _set_booked_seats(self, flight_id, booked_seats):
+        record = self._flights.get(flight_id)
+        if record is not None:
+            record.booked_seats = max(record.booked_seats, booked_seats)
+
+    # Изменения применяются после коммита. Пока расписание не загружено, они нужны только идущей загрузке:
+    # её снимок мог быть прочитан до коммита
+    def upsert(self, flight):
+        record = TimetableFlight(flight)
+        with self._lock:
+            if self.loaded:
+                self._apply(record.id, record)
+            elif self._loading:
+                self._pending[record.id] = record
+
+    def remove(self, flight_id):
+        with self._lock:
+            if self.loaded:
+                self._apply(flight_id, None)
+            elif self._loading:
+                self._pending[flight_id] = None
+
+    def set_booked_seats(self, flight_id, booked_seats):
+        with self._lock:
+            if self.loaded:
+                self._set_booked_seats(flight_id, booked_seats)
+            elif self._loading:
+                self._pending_seats[flight_id] = max(self._pending_seats.get(flight_id, 0), booked_seats)
+
+    def connections(self, from_city, date_from, date_to, passengers, max_legs):
+        # Только рейсы окна, достижимые из from_city не более чем за max_legs перелётов
+        start, end = to_seconds(date_from), to_seconds(date_to)
+        connections = []
+        with self._lock:
+            seen = {from_city}
+            frontier = [from_city]
+            for _ in range(max_legs):
+                next_frontier = []
+                for city in frontier:
+                    keys = self._keys.get(city)
+                    if not keys:
+                        continue
+                    departures = self._departures[city]
+                    for i in range(bisect_left(keys, (start,)), bisect_left(keys, (end, float("inf")))):
+                        record = departures[i]
+                        if record.total_seats - record.booked_seats < passengers or record.arrival < record.departure:
+                            continue
+                        connections.append(record.connection)
+                        if record.arrival_city not in seen:
+                            seen.add(record.arrival_city)
+                            next_frontier.append(record.arrival_city)
+                frontier = next_frontier
+        connections.sort()
+        return connections
+
+flight_timetable = FlightTimetable(enabled=FLIGHT_TIMETABLE_ENABLED)
+
+def timetable_statement():
+    return select(
+        Flight.id, Flight.departure_city, Flight.arrival_city, Flight.departure_time,
+        Flight.arrival_time, Flight.price, Flight.total_seats, Flight.booked_seats
+    )
+
+# Утилиты маршрутов для рейсов
+# Колонки ответа FlightOut: свободные места считает БД, списки рейсов обходятся без ORM-объектов
+FLIGHT_OUT_COLUMNS = (
+    Flight.id, Flight.departure_city, Flight.arrival_city, Flight.departure_time, Flight.arrival_time, Flight.price,
+    (Flight.total_seats - Flight.booked_seats).label("available_seats"),
+)
+
+@app.post("/flights", response_model=FlightOut)
+def create_flight(flight: FlightCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    new_flight = Flight(**flight.dict(), booked_seats=0)
+    db.add(new_flight)
+    db.flush()
+    refresh_fare_summary(db, {fare_key(new_flight)})
+    db.commit()
+    db.refresh(new_flight)
+    flight_timetable.upsert(new_flight)
+    flights_changed(departures=[new_flight.departure_time])
+    return flight_out(new_flight)
+
+@app.get("/flights", response_model=List[FlightOut])
+def get_flights(request: Request, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                stream: bool = False, db=Depends(get_db)):
+    columns = (Flight.id,)
+    statement = keyset_page(select(*FLIGHT_OUT_COLUMNS).order_by(Flight.id), "id", columns, False, cursor, limit)
+    if stream:
+        return stream_ndjson(statement)
+
+    def load():
+        flights, next_cursor = page_rows(db.execute(statement).all(), "id", columns, limit)
+        return row_dicts(flights), next_cursor
+
+    return catalog_response(request, "flights", load)
+
+@app.put("/flights/{flight_id}", response_model=FlightOut)
+def update_flight(flight_id: int, flight: FlightCreate, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    db_flight = db.query(Flight).filter(Flight.id == flight_id).first()
+    if not db_flight:
+        raise HTTPException(status_code=404, detail="Flight not found")
+    previous_departure = db_flight.departure_time
+    previous_fare = fare_key(db_flight)
+    for key, value in flight.dict().items():
+        setattr(db_flight, key, value)
+    db.flush()
+    refresh_fare_summary(db, {previous_fare, fare_key(db_flight)})
+    db.commit()
+    db.refresh(db_flight)
+    flight_timetable.upsert(db_flight)
+    flights_changed([flight_id], [previous_departure, db_flight.departure_time])
+    return flight_out(db_flight)
+
+@app.delete("/flights/{flight_id}")
+def delete_flight(flight_id: int, admin: User = Depends(get_current_admin), db=Depends(get_db)):
+    db_flight = db.query(Flight).filter(Flight.id == flight_id).first()
+    if not db_flight:
+        raise HTTPException(status_code=404, detail="Flight not found")
+    fare = fare_key(db_flight)
+    db.delete(db_flight)
+    db.flush()
+    refresh_fare_summary(db, {fare})
+    db.commit()
+    flight_timetable.remove(flight_id)
+    flights_changed([flight_id])
+    return {"msg": "Flight deleted"}
+
+def explore_statement(from_city, date_from, date_to, max_price=None):
+    query = select(FareSummary).where(
+        FareSummary.departure_city == from_city, FareSummary.day >= date_from, FareSummary.day <= date_to
+    )
+    if max_price is not None:
+        query = query.where(FareSummary.min_price <= max_price)
+    return query
+
+# Куда можно улететь из города: для каждого направления самый дешёвый день диапазона по сводке тарифов
+@app.get("/flights/explore", response_model=List[ExploreResult])
+def explore_flights(
+    from_city: str,
+    date_from: date,
+    date_to: Optional[date] = None,
+    max_price: Optional[float] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db=Depends(get_db)
+):
+    date_to = date_to or date_from
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+    best = {}
+    for fare in db.scalars(explore_statement(from_city, date_from, date_to, max_price)):
+        current = best.get(fare.arrival_city)
+        if current is None or (fare.min_price, fare.day) < (current.min_price, current.day):
+            best[fare.arrival_city] = fare
+    results = sorted(best.values(), key=lambda fare: (fare.min_price, fare.arrival_city))
+    return results[:limit] if limit else results
+
+# Функция поиска путей
+# group — день вылета при гибком поиске: метки разных дней не доминируют друг над другом
+class SearchLabel:
+    __slots__ = ("price", "start", "arrival", "legs", "via", "cities", "flight", "parent", "group")
+
+    def __init__(self, price, start, arrival, legs, via, cities, flight, parent=None, group=0):
+        self.price = price
+        self.start = start
+        self.arrival = arrival
+        self.legs = legs
+        self.via = via
+        self.cities = cities
+        self.flight = flight
+        self.parent = parent
+        self.group = group
+
+    def dominates(self, other):
+        return (
+            self.price <= other.price
+            and self.arrival - self.start <= other.arrival - other.start
+            and self.legs <= other.legs
+            and self.via >= other.via
+            and self.group == other.group
+        )
+
+    def flights(self):
+        flights = []
+        label = self
+        while label is not None:
+            flights.append(label.flight)
+            label = label.parent
+        flights.reverse()
+        return flights
+
+def insert_label(bag, label):
+    for other in bag:
+        if other.dominates(label):
+            return False
+    bag[:] = [other for other in bag if not label.dominates(other)]
+    bag.append(label)
+    return True
+
+def flight_connections(flights):
+    connections = []
+    for f in flights:
+        departure, arrival = to_seconds(f.departure_time), to_seconds(f.arrival_time)
+        if arrival >= departure:
+            connections.append((departure, arrival, f.id, f))
+    connections.sort()
+    return connections
+
+def bounds_to(city, connections, min_layover):
+    # Нижние оценки пути до города: число перелётов, цена и время в пути с минимальными пересадками
+    edges = {}
+    for departure, arrival, _, f in connections:
+        key = (f.departure_city, f.arrival_city)
+        edge = edges.get(key)
+        if edge is None:
+            edges[key] = [f.price, arrival - departure]
+        else:
+            if f.price < edge[0]:
+                edge[0] = f.price
+            if arrival - departure < edge[1]:
+                edge[1] = arrival - departure
+    reverse = defaultdict(list)
+    for (departure_city, arrival_city), (price, duration) in edges.items():
+        reverse[arrival_city].append((departure_city, price, duration))
+
+    hops = {city: 0}
+    queue = deque([city])
+    while queue:
+        current = queue.popleft()
+        for previous, _, _ in reverse[current]:
+            if previous not in hops:
+                hops[previous] = hops[current] + 1
+                queue.append(previous)
+
+    def dijkstra(index):
+        best = {city: 0.0}
+        heap = [(0.0, city)]
+        while heap:
+            cost, current = heapq.heappop(heap)
+            if cost > best[current]:
+                continue
+            transfer = min_layover if current != city else 0.0
+            for edge in reverse[current]:
+                previous, candidate = edge[0], cost + edge[index] + transfer
+                if candidate < best.get(previous, float("inf")):
+                    best[previous] = candidate
+                    heapq.heappush(heap, (candidate, previous))
+        return best
+
+    prices = dijkstra(1)
+    durations = dijkstra(2)
+    return {c: (hops[c], prices[c], durations[c]) for c in hops}
+
+def pareto_connection_search(connections, from_city, to_city, via_city=None,
+                             min_layover=timedelta(minutes=MIN_LAYOVER_MINUTES),
+                             max_layover=timedelta(minutes=MAX_LAYOVER_MINUTES),
+                             max_legs=MAX_FLIGHT_LEGS, days=None):
+    # Просмотр рейсов по времени вылета (Connection Scan). connections: отсортированные кортежи
+    # (вылет, прилёт в секундах, id, рейс). Метка хранит цену, время начала, число перелётов и то,
+    # пройден ли via_city; в ответ попадает Парето-фронт по цене, времени в пути и числу перелётов.
+    # days = (начало окна первого дня, число дней, длина окна) — гибкий поиск: окно дня k сдвинуто на k суток,
+    # один проход строит отдельный фронт для каждого дня. Первый вылет может попасть в окна нескольких дней,
+    # и маршрут продолжается в каждом из них, пока его рейсы не выходят за конец окна
+    if via_city in (from_city, to_city):
+        via_city = None
+    min_layover = min_layover.total_seconds()
+    max_layover = max_layover.total_seconds()
+    to_target = bounds_to(to_city, connections, min_layover)
+    to_via = bounds_to(via_city, connections, min_layover) if via_city else {}
+    via_to_target = to_target.get(via_city) if via_city else None
+
+    def remaining(city, via):
+        if via_city is None or via:
+            return to_target.get(city)
+        if city == to_city or via_to_target is None or city not in to_via:
+            return None
+        hops, price, duration = to_via[city]
+        return (hops + via_to_target[0], price + via_to_target[1], duration + via_to_target[2] + min_layover)
+
+    if remaining(from_city, False) is None:
+        return []
+
+    # Для каждого города: метки, ещё не доступные для пересадки (куча по времени прилёта),
+    # и метки в текущем окне пересадки без тех, что доминируются более поздним прилётом
+    pending = {}
+    active = {}
+    bounds = {}
+    # Найденные маршруты по дням: отсечение сравнивает метку только с маршрутами её дня
+    results = defaultdict(list)
+    heappush, heappop = heapq.heappush, heapq.heappop
+    # Раскрытые узлы поиска: метки, продолжившие маршрут хотя бы на один рейс
+    expanded = 0
+
+    for departure, arrival, _, flight in connections:
+        city = flight.departure_city
+        from_origin = city == from_city
+        waiting = pending.get(city)
+        window = active.get(city)
+        if not (from_origin or waiting or window) or city == to_city:
+            continue
+        arrival_city = flight.arrival_city
+        city_bounds = bounds.get(arrival_city)
+        if city_bounds is None:
+            city_bounds = bounds[arrival_city] = (
+                remaining(arrival_city, True), remaining(arrival_city, arrival_city == via_city)
+            )
+        bound_with_via, bound_without_via = city_bounds
+        if bound_with_via is None and bound_without_via is None:
+            continue
+
+        origins = ()
+        if from_origin:
+            if days is None:
+                origins = [0]
+            else:
+                offset = departure - days[0]
+                origins = list(range(max(0, math.ceil((offset - days[2]) / 86400)), min(days[1], int(offset // 86400) + 1)))
+        if window is None:
+            window = active[city] = []
+        while waiting and waiting[0][0] <= departure - min_layover:
+            entering = heappop(waiting)[2]
+            window[:] = [
+                o for o in window
+                if not (entering.price <= o.price and entering.start >= o.start
+                        and entering.legs <= o.legs and entering.via >= o.via and entering.group == o.group)
+            ]
+            window.append(entering)
+        expired = 0
+        while expired < len(window) and window[expired].arrival < departure - max_layover:
+            expired += 1
+        if expired:
+            del window[:expired]
+        if not window and not origins:
+            continue
+
+        arrives_via = arrival_city == via_city
+        bag = []
+        # Элементы origins — номера дней, для которых рейс начинает новый маршрут
+        for previous in (window + origins if origins else window):
+            if previous.__class__ is int:
+                price, start, legs, via, group = flight.price, departure, 1, arrives_via, previous
+                previous = None
+            else:
+                if arrival_city in previous.cities:
+                    continue
+                price, start, legs = previous.price + flight.price, previous.start, previous.legs + 1
+                via = previous.via or arrives_via
+                group = previous.group
+                if days is not None and departure > days[0] + group * 86400 + days[2]:
+                    continue
+            bound = bound_with_via if via else bound_without_via
+            if bound is None or legs + bound[0] > max_legs:
+                continue
+            # Продолжение метки не станет лучше уже найденного маршрута
+            duration = arrival - start
+            if any(
+                r.price <= price + bound[1]
+                and r.arrival - r.start <= duration + bound[2]
+                and r.legs <= legs + bound[0]
+                for r in results.get(group, ())
+            ):
+                continue
+            if any(
+                o.price <= price and o.start >= start and o.legs <= legs and o.via >= via and o.group == group
+                for o in bag
+            ):
+                continue
+            cities = (city, arrival_city) if previous is None else previous.cities + (arrival_city,)
+            insert_label(bag, SearchLabel(price, start, arrival, legs, via, cities, flight, previous, group))
+            expanded += 1
+
+        if arrival_city == to_city:
+            for label in bag:
+                insert_label(results[label.group], label)
+        elif bag:
+            waiting = pending.get(arrival_city)
+            if waiting is None:
+                waiting = pending[arrival_city] = []
+            for label in bag:
+                heappush(waiting, (arrival, id(label), label))
+
+    note_search_nodes(expanded)
+    results = [label for group_results in results.values() for label in group_results]
+    results.sort(key=lambda label: (label.price, label.arrival - label.start, label.legs))
+    return results
+
+# Поля FlightOut без модели: результат поиска собирает каждый рейс один раз и кодирует его сразу
+def flight_out(f):
+    return {
+        "id": f.id,
+        "departure_city": f.departure_city,
+        "arrival_city": f.arrival_city,
+        "departure_time": f.departure_time,
+        "arrival_time": f.arrival_time,
+        "price": f.price,
+        "available_seats": f.total_seats - f.booked_seats,
+    }
+
+def search_window_statement(date_from, date_to, passengers):
+    return select(Flight).where(
+        Flight.departure_time >= date_from,
+        Flight.departure_time <= date_to,
+        Flight.total_seats - Flight.booked_seats >= passengers
+    )
+
+def load_search_connections(db, from_city, date_from, date_to, passengers, max_legs):
+    if flight_timetable.enabled and flight_timetable.ensure_loaded(db):
+        return flight_timetable.connections(from_city, date_from, date_to, passengers, max_legs)
+    return flight_connections(db.scalars(search_window_statement(date_from, date_to, passengers)).all())
+
+async def load_search_connections_async(db, from_city, date_from, date_to, passengers, max_legs):
+    if flight_timetable.enabled and await flight_timetable.ensure_loaded_async(db):
+        return flight_timetable.connections(from_city, date_from, date_to, passengers, max_legs)
+    return flight_connections((await db.scalars(search_window_statement(date_from, date_to, passengers))).all())
+
+def build_search_results(connections, from_city, to_city, via_city=None,
+                         min_layover=timedelta(minutes=MIN_LAYOVER_MINUTES),
+                         max_layover=timedelta(minutes=MAX_LAYOVER_MINUTES),
+                         max_legs=MAX_FLIGHT_LEGS):
+    labels = pareto_connection_search(connections, from_city, to_city, via_city, min_layover, max_layover, max_legs)
+    return search_results(labels, from_city)
+
+def search_results(labels, from_city):
+    outputs = {}
+    results = []
+    for label in labels:
+        flights = label.flights()
+        for f in flights:
+            if f.id not in outputs:
+                outputs[f.id] = flight_out(f)
+        results.append({
+            "path": [from_city] + [f.arrival_city for f in flights],
+            "flights": [outputs[f.id] for f in flights],
+            "total_price": label.price,
+            "total_time": (label.arrival - label.start) / 3600,
+            "category": None
+        })
+
+    return results
+
+# Гибкие даты: окно поиска сдвигается на ±flexible_days, но рейсы загружаются и просматриваются один раз
+# для объединённого окна. Для каждого дня остаётся лучший маршрут его фронта: самый дешёвый, затем самый быстрый
+def flexible_search_window(search_data):
+    shift = timedelta(days=search_data.flexible_days)
+    return search_data.date_from - shift, search_data.date_to + shift
+
+def build_flexible_results(connections, search_data):
+    first_day = search_data.date_from - timedelta(days=search_data.flexible_days)
+    days = (to_seconds(first_day), 2 * search_data.flexible_days + 1, (search_data.date_to - search_data.date_from).total_seconds())
+    labels = pareto_connection_search(
+        connections, search_data.from_city, search_data.to_city, search_data.via_city, days=days,
+        **search_limits(search_data)
+    )
+    best = {}
+    for label in labels:
+        best.setdefault(label.group, label)
+    results = search_results([best[group] for group in sorted(best)], search_data.from_city)
+    for group, result in zip(sorted(best), results):
+        result["date"] = (first_day + timedelta(days=group)).date()
+    return results
+
+def find_shortest_paths(db, from_city, to_city, date_from, date_to, passengers, via_city=None,
+                        min_layover=timedelta(minutes=MIN_LAYOVER_MINUTES),
+                        max_layover=timedelta(minutes=MAX_LAYOVER_MINUTES),
+                        max_legs=MAX_FLIGHT_LEGS):
+    connections = load_search_connections(db, from_city, date_from, date_to, passengers, max_legs)
+    return build_search_results(connections, from_city, to_city, via_city, min_layover, max_layover, max_legs)
+
+def search_limits(search_data):
+    return {
+        "min_layover": timedelta(minutes=search_data.min_layover_minutes),
+        "max_layover": timedelta(minutes=search_data.max_layover_minutes),
+        "max_legs": search_data.max_legs,
+    }
+
+def rank_search_results(results, order_by=None, order_by_time=None):
+    if results:
+        fastest_time = min(r["total_time"] for r in results)
+        cheapest_price = min(r["total_price"] for r in results)
+        for result in results:
+            if result["total_time"] == fastest_time:
+                result["category"] = "fastest"
+            elif result["total_price"] == cheapest_price:
+                result["category"] = "cheapest"
+
+    if order_by_time:
+        if order_by_time == "time_asc":
+            results.sort(key=lambda x: x["flights"][0]["departure_time"] if x["flights"] else datetime.max)
+        elif order_by_time == "time_desc":
+            results.sort(key=lambda x: x["flights"][0]["departure_time"] if x["flights"] else datetime.min, reverse=True)
+    elif order_by:
+        if order_by == "price_asc":
+            results.sort(key=lambda x: x["total_price"])
+        elif order_by == "price_desc":
+            results.sort(key=lambda x: x["total_price"], reverse=True)
+    else:
+        def sort_key(item):
+            if item["category"] == "fastest":
+                return (0, item["total_price"])
+            elif item["category"] == "cheapest":
+                return (1, item["total_price"])
+            else:
+                return (2, item["total_price"])
+        results.sort(key=sort_key)
+
+    return results
+
+# Кэш результатов поиска: одинаковые параллельные запросы ждут одного вычисления
+class PendingSearch:
+    __slots__ = ("event", "result", "done")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.done = False
+
+class SearchCache:
+    def __init__(self, max_size, ttl, enabled=True):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Ключ -> (результат, срок жизни, окно вылетов, id рейсов в результате)
+        self._entries = OrderedDict()
+        self._keys_by_flight = defaultdict(set)
+        self._pending = {}
+        # Любой сброс увеличивает поколение; результат, посчитанный на фоне сброса, не сохраняется
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for flight_id in entry[3]:
+            keys = self._keys_by_flight.get(flight_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_flight[flight_id]
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _store(self, key, result, window, flight_ids):
+        self._drop(key)
+        self._entries[key] = (result, time.time() + self.ttl, window, flight_ids)
+        for flight_id in flight_ids:
+            self._keys_by_flight[flight_id].add(key)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def get_or_compute(self, key, window, compute):
+        if not self.enabled:
+            return compute()
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[0]
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = PendingSearch()
+                self.misses += 1
+                generation = self._generation
+            else:
+                self.coalesced += 1
+        if not leader:
+            pending.event.wait()
+            # Если вычисление у первого запроса упало, ожидающий считает сам
+            return pending.result if pending.done else compute()
+        try:
+            result = compute()
+            pending.result = result
+            pending.done = True
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if pending.done and generation == self._generation:
+                    flight_ids = frozenset(f["id"] for item in result for f in item["flights"])
+                    self._store(key, result, window, flight_ids)
+            pending.event.set()
+        return result
+
+    # Бронирование или удаление рейса меняет только результаты, в которые он входит;
+    # новый или перенесённый вылет может появиться в любом поиске, чьё окно его покрывает
+    def invalidate(self, flight_ids=(), departures=()):
+        with self._lock:
+            self._generation += 1
+            for flight_id in flight_ids:
+                for key in list(self._keys_by_flight.get(flight_id, ())):
+                    self._drop(key)
+            moments = [to_seconds(moment) for moment in departures]
+            if moments:
+                for key, entry in list(self._entries.items()):
+                    start, end = entry[2]
+                    if any(start <= moment <= end for moment in moments):
+                        self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_flight.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, enabled=SEARCH_CACHE_ENABLED)
+
+def search_cache_key(search_data, order_by, order_by_time):
+    return (
+        search_data.from_city, search_data.to_city, to_seconds(search_data.date_from), to_seconds(search_data.date_to),
+        search_data.passengers, search_data.via_city or None, search_data.min_layover_minutes,
+        search_data.max_layover_minutes, search_data.max_legs, order_by, order_by_time,
+    )
+
+def search_window(search_data):
+    return to_seconds(search_data.date_from), to_seconds(search_data.date_to)
+
+# Изменение рейсов после коммита: сбрасывает зависящие от них ответы каталога и результаты поиска
+def flights_changed(flight_ids=(), departures=()):
+    catalog_versions.bump("flights")
+    search_cache.invalidate(flight_ids, departures)
+
+# Утилита для поиска рейсов
+@app.post("/flights/search", response_model=List[FlightSearchResult])
+def search_flights(
+    search_data: FlightSearch,
+    order_by: Optional[str] = Query(None, description="Sort by: price_asc, price_desc"),
+    order_by_time: Optional[str] = Query(None, description="Sort by: time_asc, time_desc"),
+    db=Depends(get_db)
+):
+    from_city = search_data.from_city
+    to_city = search_data.to_city
+    date_from = search_data.date_from
+    date_to = search_data.date_to
+    passengers = search_data.passengers
+    via_city = search_data.via_city
+
+    def compute():
+        results = find_shortest_paths(
+            db, from_city, to_city, date_from, date_to, passengers, via_city, **search_limits(search_data)
+        )
+        return rank_search_results(results, order_by, order_by_time)
+
+    return json_response(search_cache.get_or_compute(
+        search_cache_key(search_data, order_by, order_by_time), search_window(search_data), compute
+    ))
+
+@app.post("/flights/search/flexible", response_model=List[FlexibleSearchResult])
+def search_flights_flexible(
+    search_data: FlightSearch,
+    order_by: Optional[str] = Query(None, description="Sort by: price_asc, price_desc"),
+    order_by_time: Optional[str] = Query(None, description="Sort by: time_asc, time_desc"),
+    db=Depends(get_db)
+):
+    if not 0 <= search_data.flexible_days <= MAX_FLEXIBLE_DAYS:
+        raise HTTPException(status_code=400, detail=f"flexible_days must be between 0 and {MAX_FLEXIBLE_DAYS}")
+    date_from, date_to = flexible_search_window(search_data)
+
+    def compute():
+        connections = load_search_connections(
+            db, search_data.from_city, date_from, date_to, search_data.passengers, search_data.max_legs
+        )
+        results = rank_search_results(build_flexible_results(connections, search_data), order_by, order_by_time)
+        # Без явной сортировки ответ — календарь цен по дням
+        if not order_by and not order_by_time:
+            results.sort(key=lambda x: x["date"])
+        return results
+
+    key = ("flexible", search_data.flexible_days) + search_cache_key(search_data, order_by, order_by_time)
+    return json_response(search_cache.get_or_compute(key, (to_seconds(date_from), to_seconds(date_to)), compute))
+
+#Утилита для бронирования билетов
+def reserve_seats_statement(flight_id, passengers):
+    # Проверка и списание мест одним UPDATE: параллельные брони не могут продать лишнее
+    return (
+        update(Flight)
+        .where(Flight.id == flight_id, Flight.total_seats - Flight.booked_seats >= passengers)
+        .values(booked_seats=Flight.booked_seats + passengers)
+        .returning(Flight.booked_seats)
+        .execution_options(synchronize_session=False)
+    )
+
+def reserve_seats(db, flight_id, passengers):
+    row = db.execute(reserve_seats_statement(flight_id, passengers)).first()
+    return None if row is None else row.booked_seats
+
+def reservation_error(flight_exists):
+    if not flight_exists:
+        return HTTPException(status_code=404, detail="Flight not found")
+    return HTTPException(status_code=400, detail="Not enough seats")
+
+def validate_booking_request(flight_ids, passengers):
+    if not flight_ids:
+        raise HTTPException(status_code=400, detail="No flights to book")
+    if passengers < 1:
+        raise HTTPException(status_code=400, detail="Passengers must be positive")
+
+def raise_reservation_failed(db, flight_id):
+    db.rollback()
+    raise reservation_error(db.query(Flight.id).filter(Flight.id == flight_id).first() is not None)
+
+@app.post("/flights/book/{flight_id}")
+def book_flight(flight_id: int, passengers: int, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    validate_booking_request([flight_id], passengers)
+    begin_write(db)
+    booked_seats = reserve_seats(db, flight_id, passengers)
+    if booked_seats is None:
+        raise_reservation_failed(db, flight_id)
+    refresh_sold_out_fares(db, [flight_id])
+    db.commit()
+    flight_timetable.set_booked_seats(flight_id, booked_seats)
+    flights_changed([flight_id])
+    return {"msg": "Flight booked"}
+
+@app.post("/flights/book")
+def book_itinerary(itinerary: ItineraryBooking, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    validate_booking_request(itinerary.flight_ids, itinerary.passengers)
+    begin_write(db)
+    reserved = {}
+    for flight_id in itinerary.flight_ids:
+        booked_seats = reserve_seats(db, flight_id, itinerary.passengers)
+        if booked_seats is None:
+            # Все перелёты маршрута бронируются вместе или не бронируется ни один
+            raise_reservation_failed(db, flight_id)
+        reserved[flight_id] = booked_seats
+    refresh_sold_out_fares(db, reserved)
+    db.commit()
+    for flight_id, booked_seats in reserved.items():
+        flight_timetable.set_booked_seats(flight_id, booked_seats)
+    flights_changed(reserved)
+    return {"msg": "Itinerary booked", "flight_ids": itinerary.flight_ids}
+
+# Бронирование поездки: все перелёты и комнаты проверяются и записываются в одной транзакции
+def validate_trip(trip):
+    if not trip.flight_ids and not trip.rooms:
+        raise HTTPException(status_code=400, detail="Trip is empty")
+    if trip.flight_ids:
+        validate_booking_request(trip.flight_ids, trip.passengers)
+    for room in trip.rooms:
+        validate_booking_dates(room.check_in, room.check_out)
+
+def trip_out(trip, flights, bookings):
+    by_id = {f.id: f for f in flights}
+    return TripOut(
+        flights=[flight_out(by_id[flight_id]) for flight_id in trip.flight_ids],
+        bookings=[BookingOut.model_validate(booking) for booking in bookings],
+    )
+
+def apply_trip(reserved):
+    for flight_id, booked_seats in reserved.items():
+        flight_timetable.set_booked_seats(flight_id, booked_seats)
+    if reserved:
+        flights_changed(reserved)
+
+@app.post("/trips/book", response_model=TripOut)
+def book_trip(trip: TripBooking, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    validate_trip(trip)
+    begin_write(db)
+    reserved = {}
+    for flight_id in trip.flight_ids:
+        booked_seats = reserve_seats(db, flight_id, trip.passengers)
+        if booked_seats is None:
+            raise_reservation_failed(db, flight_id)
+        reserved[flight_id] = booked_seats
+    bookings = []
+    for room in trip.rooms:
+        # Проверка идёт по БД после flush, поэтому учитывает и брони этой же поездки
+        availability = db.execute(room_availability_statement(room.room_id, room.check_in, room.check_out)).first()
+        if not room_has_free_units(availability):
+            db.rollback()
+            raise HTTPException(status_code=400, detail=f"Room {room.room_id} not available")
+        booking = Booking(user_id=current_user.id, room_id=room.room_id, check_in=room.check_in, check_out=room.check_out)
+        db.add(booking)
+        db.flush()
+        bookings.append(booking)
+    result = trip_out(trip, db.scalars(select(Flight).where(Flight.id.in_(reserved))).all(), bookings)
+    if reserved:
+        refresh_sold_out_fares(db, reserved)
+    commit_bookings(db, bookings)
+    apply_trip(reserved)
+    return result
+
+# Массовая загрузка каталога: тело CSV или NDJSON читается потоком и пишется пачками в одной транзакции на пачку
+async def request_lines(request):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    try:
+        async for chunk in request.stream():
+            pending += decoder.decode(chunk)
+            lines = pending.split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip("\r")
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be UTF-8")
+    if pending:
+        yield pending.rstrip("\r")
+
+def validation_message(error):
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in error.errors())
+
+class BulkReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def result(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.rows / seconds, 1) if seconds > 0 else None,
+        }
+
+# Upsert пачки по естественному ключу: существующие строки ищутся одним запросом, вставки и обновления идут пачкой
+def write_bulk_batch(model, key_fields, batch, report, check=None, prepare=None, before_commit=None):
+    db = SessionLocal()
+    try:
+        begin_write(db)
+        if prepare is not None:
+            batch = prepare(db, batch, report)
+        rows = {}
+        for line, values in batch:
+            key = tuple(values[field] for field in key_fields)
+            if key in rows:
+                # Повтор ключа внутри пачки: побеждает последняя строка, предыдущая считается обновлённой
+                report.updated += 1
+            rows[key] = (line, values)
+        key_columns = [getattr(model, field) for field in key_fields]
+        existing = {}
+        if rows:
+            for row in db.execute(select(model).where(tuple_(*key_columns).in_(list(rows)))).scalars():
+                existing[tuple(getattr(row, field) for field in key_fields)] = row
+        inserts, updates = [], []
+        for key, (line, values) in rows.items():
+            current = existing.get(key)
+            if current is None:
+                inserts.append(values)
+                continue
+            problem = check(current, values) if check is not None else None
+            if problem:
+                report.error(line, problem)
+            else:
+                updates.append(dict(values, id=current.id))
+        db.expunge_all()
+        if inserts:
+            db.execute(insert(model), inserts)
+        if updates:
+            db.execute(update(model), updates)
+        if before_commit is not None:
+            before_commit(updates)
+        db.commit()
+        report.inserted += len(inserts)
+        report.updated += len(updates)
+        return updates
+    finally:
+        db.close()
+
+async def bulk_ingest(request, format, schema, model, key_fields, check=None, prepare=None, before_commit=None):
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    report = BulkReport()
+    header = None
+    batch = []
+    line_number = 0
+    async for line in request_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        if format == "csv" and header is None:
+            header = [name.strip() for name in next(csv.reader([line]))]
+            continue
+        report.rows += 1
+        try:
+            if format == "csv":
+                raw = dict(zip(header, next(csv.reader([line]))))
+            else:
+                raw = json.loads(line)
+            batch.append((line_number, schema.model_validate(raw).model_dump()))
+        except ValidationError as error:
+            report.error(line_number, validation_message(error))
+        except ValueError as error:
+            report.error(line_number, f"Malformed row: {error}")
+        if len(batch) >= BULK_BATCH_SIZE:
+            await run_in_threadpool(write_bulk_batch, model, key_fields, batch, report, check, prepare, before_commit)
+            batch = []
+    if batch:
+        await run_in_threadpool(write_bulk_batch, model, key_fields, batch, report, check, prepare, before_commit)
+    return report.result()
+
+def check_flight_seats(flight, values):
+    if values["total_seats"] < flight.booked_seats:
+        return f"total_seats {values['total_seats']} is below booked seats {flight.booked_seats}"
+    return None
+
+def keep_rooms_of_known_hotels(db, batch, report):
+    hotel_ids = {values["hotel_id"] for line, values in batch}
+    known = set(db.scalars(select(Hotel.id).where(Hotel.id.in_(hotel_ids))))
+    kept = []
+    for line, values in batch:
+        if values["hotel_id"] in known:
+            kept.append((line, values))
+        else:
+            report.error(line, f"Hotel {values['hotel_id']} not found")
+    return kept
+
+# Обновлённые комнаты выгружаются из индекса броней до коммита пачки, под её блокировкой записи
+def drop_indexed_rooms(updates):
+    for values in updates:
+        booking_index.drop_room(values["id"])
+
+# Массовая загрузка может изменить любой день, поэтому сводка тарифов пересчитывается целиком
+def rebuild_fare_summary_now():
+    db = SessionLocal()
+    try:
+        begin_write(db)
+        rebuild_fare_summary(db)
+        db.commit()
+    finally:
+        db.close()
+
+@app.post("/flights/bulk")
+async def bulk_flights(request: Request, format: Optional[str] = None, admin: User = Depends(get_current_admin)):
+    try:
+        return await bulk_ingest(request, format, FlightCreate, Flight,
+                                 ("departure_city", "arrival_city", "departure_time"), check=check_flight_seats)
+    finally:
+        await run_in_threadpool(rebuild_fare_summary_now)
+        # Расписание перечитается из БД при следующем поиске
+        flight_timetable.reset()
+        catalog_versions.bump("flights")
+        search_cache.clear()
+
+@app.post("/hotels/bulk")
+async def bulk_hotels(request: Request, format: Optional[str] = None, admin: User = Depends(get_current_admin)):
+    try:
+        return await bulk_ingest(request, format, HotelCreate, Hotel, ("name", "city"))
+    finally:
+        # Индекс автодополнения перечитается из БД при следующем запросе
+        hotel_autocomplete.reset()
+        catalog_versions.bump("hotels")
+
+@app.post("/rooms/bulk")
+async def bulk_rooms(request: Request, format: Optional[str] = None, admin: User = Depends(get_current_admin)):
+    try:
+        return await bulk_ingest(request, format, RoomCreate, Room, ("hotel_id", "type"),
+                                 prepare=keep_rooms_of_known_hotels, before_commit=drop_indexed_rooms)
+    finally:
+        catalog_versions.bump("rooms")
+
+# Архивация истории: завершённые брони и прошедшие рейсы переносятся в архивные таблицы пачками,
+# каждая пачка — короткая транзакция INSERT ... SELECT и DELETE, чтобы не держать блокировку записи долго
+def archive_bookings_statement(cutoff, batch_size):
+    return select(Booking.id, Booking.room_id).where(Booking.check_out <= cutoff).limit(batch_size)
+
+def archive_flights_statement(cutoff, batch_size):
+    return select(Flight.id, Flight.departure_city, Flight.departure_time).where(
+        Flight.departure_time < cutoff
+    ).order_by(Flight.departure_time).limit(batch_size)
+
+def archive_batches(db, statement, model, archive, before_commit=None, after_commit=None):
+    columns = list(model.__table__.columns)
+    moved = 0
+    while True:
+        begin_write(db)
+        rows = db.execute(statement).all()
+        if not rows:
+            db.commit()
+            return moved
+        ids = [row.id for row in rows]
+        db.execute(insert(archive).from_select(
+            [column.name for column in columns] + ["archived_at"],
+            select(*columns, literal(datetime.utcnow(), DateTime)).where(model.id.in_(ids))
+        ))
+        db.execute(delete(model).where(model.id.in_(ids)))
+        if before_commit:
+            before_commit(db, rows)
+        db.commit()
+        if after_commit:
+            after_commit(rows)
+        moved += len(rows)
+
+def forget_archived_bookings(rows):
+    for row in rows:
+        booking_index.remove_booking(row.room_id, row.id)
+
+# Рейсы уходят в архив по порядку вылета: все дни до последнего дня пачки уже пусты и удаляются из сводки
+# одним запросом, пересчитывается только последний день
+def refresh_archived_fares(db, rows):
+    last_day = rows[-1].departure_time.date()
+    db.execute(delete(FareSummary).where(FareSummary.day < last_day))
+    refresh_fare_summary(db, {fare_key(row) for row in rows if row.departure_time.date() == last_day})
+
+def forget_archived_flights(rows):
+    for row in rows:
+        flight_timetable.remove(row.id)
+    flights_changed([row.id for row in rows], [row.departure_time for row in rows])
+
+def archive_history(cutoff=None, batch_size=ARCHIVE_BATCH_SIZE):
+    if cutoff is None:
+        cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    db = SessionLocal()
+    try:
+        return {
+            "bookings": archive_batches(db, archive_bookings_statement(cutoff, batch_size), Booking, BookingArchive,
+                                        after_commit=forget_archived_bookings),
+            "flights": archive_batches(db, archive_flights_statement(cutoff, batch_size), Flight, FlightArchive,
+                                       before_commit=refresh_archived_fares, after_commit=forget_archived_flights),
+        }
+    finally:
+        db.close()
+
+def archive_periodically(stop, interval):
+    while not stop.wait(interval):
+        try:
+            moved = archive_history()
+        except Exception:
+            logger.exception("History archival failed")
+            continue
+        if moved["bookings"] or moved["flights"]:
+            logger.info("Archived %d bookings and %d flights", moved["bookings"], moved["flights"])
+
+def start_archiver(interval=ARCHIVE_INTERVAL_SECONDS):
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=archive_periodically, args=(stop, interval), name="archiver", daemon=True).start()
+    return stop
+
+# Асинхронные версии горячих эндпоинтов: при ASYNC_DB_ENABLED=1 заменяют синхронные
+async_router = APIRouter()
+
+@async_router.post("/register")
+async def register_async(user: UserCreate, db=Depends(get_async_db)):
+    if (await db.execute(select(User.id).where(User.email == user.email))).first():
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = await password_hasher.call_async("hash", user.password)
+    db.add(User(email=user.email, name=user.name, hashed_password=hashed_password, role=user.role))
+    await db.commit()
+    return {"msg": "User created"}
+
+@async_router.post("/token", response_model=Token)
+async def login_async(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get_async_db)):
+    user = (await db.scalars(select(User).where(User.email == form_data.username))).first()
+    if not user or not await password_hasher.call_async("verify", form_data.password, user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return create_user_token(user)
+
+@async_router.get("/available_rooms", response_model=List[RoomOut])
+async def get_available_rooms_async(
+    check_in: datetime,
+    check_out: datetime,
+    hotel_id: Optional[int] = None,
+    type: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    capacity: Optional[int] = None,
+    order_by_price: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    db=Depends(get_async_db)
+):
+    return json_response(row_dicts(await db.execute(available_rooms_statement(
+        check_in, check_out, hotel_id, type, price_min, price_max, capacity, order_by_price, limit, offset
+    ))))
+
+async def create_booking_async(db, user_id, room_id, check_in, check_out):
+    validate_booking_dates(check_in, check_out)
+    await begin_write_async(db)
+    if not await is_room_available_async(db, room_id, check_in, check_out):
+        raise HTTPException(status_code=400, detail="Room not available")
+    new_booking = Booking(user_id=user_id, room_id=room_id, check_in=check_in, check_out=check_out)
+    db.add(new_booking)
+    await commit_bookings_async(db, [new_booking])
+    await db.refresh(new_booking)
+    return new_booking
+
+@async_router.post("/bookings/by_dates", response_model=BookingOut)
+async def book_by_dates_async(booking: BookingCreate, current_user: User = Depends(get_current_user), db=Depends(get_async_db)):
+    return await create_booking_async(db, current_user.id, booking.room_id, booking.check_in, booking.check_out)
+
+@async_router.post("/bookings/by_days", response_model=BookingOut)
+async def book_by_days_async(room_id: int, check_in: datetime, days: int, current_user: User = Depends(get_current_user), db=Depends(get_async_db)):
+    return await create_booking_async(db, current_user.id, room_id, check_in, check_in + timedelta(days=days))
+
+@async_router.post("/flights/search", response_model=List[FlightSearchResult])
+async def search_flights_async(
+    search_data: FlightSearch,
+    order_by: Optional[str] = Query(None, description="Sort by: price_asc, price_desc"),
+    order_by_time: Optional[str] = Query(None, description="Sort by: time_asc, time_desc"),
+    db=Depends(get_async_db)
+):
+    loop = asyncio.get_running_loop()
+
+    # Рейсы читает только промах кэша или первый из одинаковых запросов: вычисление идёт в пуле потоков,
+    # а загрузка через асинхронную сессию выполняется в цикле событий
+    def compute():
+        connections = asyncio.run_coroutine_threadsafe(load_search_connections_async(
+            db, search_data.from_city, search_data.date_from, search_data.date_to,
+            search_data.passengers, search_data.max_legs
+        ), loop).result()
+        results = build_search_results(
+            connections, search_data.from_city, search_data.to_city, search_data.via_city, **search_limits(search_data)
+        )
+        return rank_search_results(results, order_by, order_by_time)
+
+    # Поиск нагружает CPU, поэтому выполняется в пуле потоков, а не в цикле событий
+    return json_response(await run_in_threadpool(
+        search_cache.get_or_compute, search_cache_key(search_data, order_by, order_by_time),
+        search_window(search_data), compute
+    ))
+
+async def reserve_flights_async(db, flight_ids, passengers):
+    validate_booking_request(flight_ids, passengers)
+    await begin_write_async(db)
+    reserved = {}
+    for flight_id in flight_ids:
+        row = (await db.execute(reserve_seats_statement(flight_id, passengers))).first()
+        if row is None:
+            await db.rollback()
+            exists = (await db.execute(select(Flight.id).where(Flight.id == flight_id))).first()
+            raise reservation_error(exists is not None)
+        reserved[flight_id] = row.booked_seats
+    await db.run_sync(refresh_sold_out_fares, reserved)
+    await db.commit()
+    for flight_id, booked_seats in reserved.items():
+        flight_timetable.set_booked_seats(flight_id, booked_seats)
+    flights_changed(reserved)
+
+@async_router.post("/flights/book/{flight_id}")
+async def book_flight_async(flight_id: int, passengers: int, current_user: User = Depends(get_current_user), db=Depends(get_async_db)):
+    await reserve_flights_async(db, [flight_id], passengers)
+    return {"msg": "Flight booked"}
+
+@async_router.post("/flights/book")
+async def book_itinerary_async(itinerary: ItineraryBooking, current_user: User = Depends(get_current_user), db=Depends(get_async_db)):
+    await reserve_flights_async(db, itinerary.flight_ids, itinerary.passengers)
+    return {"msg": "Itinerary booked", "flight_ids": itinerary.flight_ids}
+
+@async_router.post("/trips/book", response_model=TripOut)
+async def book_trip_async(trip: TripBooking, current_user: User = Depends(get_current_user), db=Depends(get_async_db)):
+    validate_trip(trip)
+    await begin_write_async(db)
+    reserved = {}
+    for flight_id in trip.flight_ids:
+        row = (await db.execute(reserve_seats_statement(flight_id, trip.passengers))).first()
+        if row is None:
+            await db.rollback()
+            exists = (await db.execute(select(Flight.id).where(Flight.id == flight_id))).first()
+            raise reservation_error(exists is not None)
+        reserved[flight_id] = row.booked_seats
+    bookings = []
+    for room in trip.rooms:
+        availability = (await db.execute(room_availability_statement(room.room_id, room.check_in, room.check_out))).first()
+        if not room_has_free_units(availability):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=f"Room {room.room_id} not available")
+        booking = Booking(user_id=current_user.id, room_id=room.room_id, check_in=room.check_in, check_out=room.check_out)
+        db.add(booking)
+        await db.flush()
+        bookings.append(booking)
+    result = trip_out(trip, (await db.scalars(select(Flight).where(Flight.id.in_(reserved)))).all(), bookings)
+    if reserved:
+        await db.run_sync(refresh_sold_out_fares, reserved)
+    await commit_bookings_async(db, bookings)
+    apply_trip(reserved)
+    return result
+
+if ASYNC_DB_ENABLED:
+    replaced = {(route.path, method) for route in async_router.routes for method in route.methods}
+    app.router.routes = [
+        route for route in app.router.routes
+        if not any((getattr(route, "path", None), method) in replaced for method in getattr(route, "methods", None) or ())
+    ]
+    app.include_router(async_router)
+
+# Планы горячих запросов: полный проход по таблице без индекса считается регрессией
+def hot_query_statements():
+    check_in = datetime(2025, 10, 25, 10)
+    check_out = check_in + timedelta(days=1)
+    room_statement, bookings_statement = room_intervals_statements(1)
+    return {
+        "available_rooms": available_rooms_statement(check_in, check_out, hotel_id=1, order_by_price="asc"),
+        "room_availability": room_availability_statement(1, check_in, check_out),
+        "room_bookings": bookings_statement,
+        "occupancy_calendar": calendar_bookings_statement(calendar_rooms_statement(hotel_id=1), check_in, check_out),
+        "fare_explore": explore_statement("Moscow", check_in.date(), check_out.date()),
+        "flight_search": search_window_statement(check_in, check_out, 1),
+        "hotels_by_city": hotels_statement(city="Paris", order_by_stars="desc"),
+        "rooms_by_hotel": rooms_statement(hotel_id=1, order_by_price="asc"),
+        "user_by_email": select(User).where(User.email == "user@example.com"),
+        "archive_bookings": archive_bookings_statement(check_in, ARCHIVE_BATCH_SIZE),
+        "archive_flights": archive_flights_statement(check_in, ARCHIVE_BATCH_SIZE),
+    }
+
+def query_plan(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    params = tuple(str(value) if isinstance(value, datetime) else value for value in params)
+    return [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params)]
+
+# SCAN — проход по всей таблице, в том числе по всему индексу (USING INDEX, USING COVERING INDEX); таблица
+# может называться псевдонимом из запроса. Горячий запрос должен искать по ключу (SEARCH); не считаются
+# только проходы по подзапросам и константной строке
+def full_table_scans(plan):
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) > 1 and words[0] == "SCAN" and not words[1].startswith("(") and words[1] != "CONSTANT":
+            scans.append(detail)
+    return scans
+
+def check_query_plans(bind):
+    failures = {}
+    with bind.connect() as connection:
+        for name, statement in hot_query_statements().items():
+            plan = query_plan(connection, statement)
+            print(f"{name}:")
+            for detail in plan:
+                print(f"    {detail}")
+            scans = full_table_scans(plan)
+            if scans:
+                failures[name] = scans
+    for name, scans in failures.items():
+        print(f"FULL SCAN in {name}: {'; '.join(scans)}")
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Обслуживание БД сервиса бронирования")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="применить миграции схемы")
+    commands.add_parser("check-plans", help="проверить планы горячих запросов на полный проход по таблицам")
+    archive = commands.add_parser("archive", help="перенести завершённые брони и прошедшие рейсы в архивные таблицы")
+    archive.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="архивировать историю старше стольких дней")
+    archive.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="строк в одной транзакции")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        # Миграции уже применены при импорте; команда сообщает текущую версию схемы
+        with engine.connect() as connection:
+            version = connection.execute(select(func.max(SchemaMigration.version))).scalar()
+        print(f"Schema version: {version}")
+    elif args.command == "check-plans":
+        sys.exit(1 if check_query_plans(engine) else 0)
+    elif args.command == "archive":
+        moved = archive_history(datetime.utcnow() - timedelta(days=args.days), args.batch_size)
+        print(f"Archived bookings: {moved['bookings']}, flights: {moved['flights']}")
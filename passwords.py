@@ -0,0 +1,20 @@
+# Хеширование паролей без побочных эффектов при импорте: модуль загружают процессы пула bcrypt
+from passlib.context import CryptContext
+import os
+import time
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    password = password[:72]
+    return pwd_context.hash(password)
+
+def timed_password_call(name, *args):
+    started = time.time()
+    result = verify_password(*args) if name == "verify" else get_password_hash(*args)
+    return result, started, time.time() - started